@@ -1,12 +1,215 @@
+from sqlalchemy import bindparam, event, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlmodel import SQLModel
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./tasks.db")
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")  # реплика для чтения (PostgreSQL), по умолчанию DATABASE_URL
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "5"))  # только PostgreSQL; у SQLite писатель один
+DB_WRITE_POOL_TIMEOUT = float(os.getenv("DB_WRITE_POOL_TIMEOUT", "60"))  # ожидание свободного писателя, сек
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # байт
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # отрицательное значение — в КиБ
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # мс
+
+def _async_url(url: str) -> str:
+    """postgres:// и postgresql:// без драйвера переводим на asyncpg"""
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+def _sqlite_pragmas(read_only: bool):
+    """PRAGMA для каждого нового соединения SQLite.
+
+    WAL позволяет читать во время записи парсера; synchronous=NORMAL в WAL
+    безопасен и не делает fsync на каждый коммит.
+    """
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    return on_connect
+
+DATABASE_URL = _async_url(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite: запись — через единственное соединение (писатель все равно один),
+# чтение GET-роутеров — через отдельный пул только для чтения.
+# PostgreSQL: обычные пулы, чтение при желании — с реплики DATABASE_READ_URL.
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=1 if IS_SQLITE else DB_WRITE_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=DB_WRITE_POOL_TIMEOUT,
+    pool_pre_ping=not IS_SQLITE
+)
+read_engine = create_async_engine(
+    _async_url(DATABASE_READ_URL) if DATABASE_READ_URL and not IS_SQLITE else DATABASE_URL,
+    pool_size=DB_READ_POOL_SIZE,
+    pool_pre_ping=not IS_SQLITE
+)
+
+if IS_SQLITE:
+    event.listen(engine.sync_engine, "connect", _sqlite_pragmas(read_only=False))
+    event.listen(read_engine.sync_engine, "connect", _sqlite_pragmas(read_only=True))
 
-engine = create_async_engine("sqlite+aiosqlite:///./tasks.db")
 DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False, class_=AsyncSession)
+ReadDBSession = sessionmaker(bind=read_engine, autoflush=False, autocommit=False, class_=AsyncSession)
 
 async def get_db():
     db = DBSession()
     try:
         yield db
     finally:
-        await db.close()
\ No newline at end of file
+        await db.close()
+
+async def get_read_db():
+    """Сессия для GET-эндпоинтов: читает параллельно с записью парсера"""
+    db = ReadDBSession()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+def _add_missing_columns(conn) -> set[str]:
+    """Добавляет в существующие таблицы столбцы, появившиеся в моделях позже.
+
+    Новые столбцы добавляются как NULL-допустимые без значения по умолчанию;
+    возвращает их имена вида "таблица.столбец" для последующего заполнения.
+    """
+    inspector = inspect(conn)
+    added = set()
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            added.add(f"{table.name}.{column.name}")
+            print(f"Добавлен столбец {table.name}.{column.name}")
+    return added
+
+def _backfill_price_fields(conn):
+    """Заполняет числовые поля цены у товаров, сохраненных до их появления"""
+    from app.services.price_service import parse_price_kopecks, parse_currency
+    
+    rows = conn.execute(text("SELECT id, price FROM products")).all()
+    updates = [
+        {"id": row.id, "price_kopecks": parse_price_kopecks(row.price), "currency": parse_currency(row.price)}
+        for row in rows
+    ]
+    if updates:
+        conn.execute(
+            text("UPDATE products SET price_kopecks = :price_kopecks, currency = :currency WHERE id = :id"),
+            updates
+        )
+        print(f"Числовые цены заполнены для {len(updates)} товаров")
+
+def _backfill_content_hash(conn):
+    """Хэши содержимого для товаров, сохраненных до их появления"""
+    from app.services.product_service import content_hash, TRACKED_FIELDS
+    
+    rows = conn.execute(text(f"SELECT id, {', '.join(TRACKED_FIELDS)} FROM products")).all()
+    updates = [{"id": row.id, "content_hash": content_hash(row)} for row in rows]
+    if updates:
+        conn.execute(text("UPDATE products SET content_hash = :content_hash WHERE id = :id"), updates)
+        print(f"Хэши содержимого заполнены для {len(updates)} товаров")
+
+def _normalize_product_links(conn):
+    """Приводит ссылки товаров к ключу normalize_link (без ?at=... и якоря).
+
+    Строки, которые после очистки совпали, схлопываются в самую свежую:
+    история цен переносится на нее, остальные удаляются. Сводная статистика
+    после этого сбрасывается и пересчитывается в ensure_product_stats.
+    """
+    from app.services.product_service import normalize_link
+
+    rows = conn.execute(text(
+        "SELECT id, link FROM products WHERE link LIKE '%?%' OR link LIKE '%#%' OR link LIKE '/product/%'"
+    )).all()
+    if not rows:
+        return
+
+    groups: dict[str, list[int]] = {}
+    for row in rows:
+        groups.setdefault(normalize_link(row.link), []).append(row.id)
+    # Уже очищенные строки с тем же ключом тоже участвуют в схлопывании
+    clean = conn.execute(
+        text("SELECT id, link FROM products WHERE link IN :links").bindparams(bindparam("links", expanding=True)),
+        {"links": list(groups)}
+    ).all()
+    for row in clean:
+        groups[row.link].append(row.id)
+
+    removed = 0
+    for link, ids in groups.items():
+        keep = max(ids)
+        duplicates = [id_ for id_ in ids if id_ != keep]
+        if duplicates:
+            params = {"keep": keep, "ids": duplicates}
+            conn.execute(
+                text("UPDATE price_history SET product_id = :keep WHERE product_id IN :ids")
+                .bindparams(bindparam("ids", expanding=True)),
+                params
+            )
+            conn.execute(
+                text("DELETE FROM products WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                params
+            )
+            removed += len(duplicates)
+        conn.execute(text("UPDATE products SET link = :link WHERE id = :id"), {"link": link, "id": keep})
+
+    if removed:
+        conn.execute(text("DELETE FROM product_stats"))
+    print(f"Ссылки товаров нормализованы: {len(rows)}, схлопнуто дубликатов: {removed}")
+
+def _create_missing_indexes(conn):
+    """Создает индексы моделей, которых нет в уже существующих таблицах.
+
+    create_all не трогает существующие таблицы, поэтому индексы, добавленные
+    в модели позже, досоздаются здесь. Перед уникальным индексом дубликаты
+    удаляются, остается самая свежая строка.
+    """
+    inspector = inspect(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique and "id" in table.c:
+                columns = ", ".join(column.name for column in index.columns)
+                conn.execute(text(
+                    f"DELETE FROM {table.name} WHERE id NOT IN "
+                    f"(SELECT MAX(id) FROM {table.name} GROUP BY {columns})"
+                ))
+            index.create(conn)
+            print(f"Создан индекс {index.name}")
+
+async def init_db():
+    """Создание таблиц и недостающих индексов БД"""
+    import app.models  # noqa: F401 — регистрирует модели в SQLModel.metadata
+
+    async with engine.begin() as conn:
+        added_columns = await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(SQLModel.metadata.create_all)
+        if "products.price_kopecks" in added_columns:
+            await conn.run_sync(_backfill_price_fields)
+        if "products.content_hash" in added_columns:
+            await conn.run_sync(_backfill_content_hash)
+        # До уникального индекса по link: иначе дубликаты схлопнулись бы по сырой ссылке
+        await conn.run_sync(_normalize_product_links)
+        await conn.run_sync(_create_missing_indexes)
@@ -1,17 +1,20 @@
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import time
-import json
-import nats
 
-from app.database import engine
-from app.models import TaskModel, ProductModel  # Импортируем модели
-from sqlmodel import SQLModel  # Импортируем SQLModel напрямую
+from app.database import init_db
+from app.services.stats_service import ensure_product_stats
+from app.services.search_service import ensure_search_index
 from app.routers import tasks, parser, products
 from app.services.websocket_service import manager_ws
-from app.scheduler import start_scheduler, shutdown_scheduler
+from app.services.browser_service import browser_pool
+from app.services.cache_service import response_cache
+from app.scheduler import start_scheduler, shutdown_scheduler, PARSER_USE_WORKERS
 
-from app.services.telegram_service import init_telegram_bot
+from app.services.telegram_service import init_telegram_bot, notify_parser_event
+from app.services.event_service import event_bus
+from app.services.watch_service import watch_engine
+from app.services.nats_service import nats_service, NATS_UPDATES_SUBJECT
 
 app = FastAPI(
     title="TODOAPI",
@@ -40,25 +43,47 @@ app.include_router(products.router)
 
 @app.on_event("startup")
 async def on_startup():
-    # Создание таблиц БД
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+    # Создание таблиц и индексов БД
+    await init_db()
+    await ensure_product_stats()
+    await ensure_search_index()
 
     await init_telegram_bot()
 
+    # Прогрев браузера для парсера. С воркерами API сам не парсит: и
+    # планировщик, и ручные запуски (/parser, Telegram) ставят задания в очередь
+    if not PARSER_USE_WORKERS:
+        try:
+            await browser_pool.start()
+        except Exception as e:
+            print(f"❌ Не удалось запустить пул браузера: {e}")
+
     # NATS подключение
-    global nc
-    nc = await nats.connect("nats://127.0.0.1:4222")
-    from app.services.parser_service import set_nats_connection
-    set_nats_connection(nc)
+    await nats_service.connect()
+    
+    # Шина событий: статусы парсера — сразу в WebSocket этого процесса,
+    # сохранения и ошибки — в NATS (в WebSocket они вернутся через подписку
+    # ниже, в том числе из других воркеров), ошибки парсера — в Telegram
+    event_bus.subscribe(manager_ws.broadcast, types={"parser_status", "system"})
+    event_bus.subscribe(nats_service.sink, types={"products_saved", "new_product", "price_drop", "removed", "error"})
+    event_bus.subscribe(notify_parser_event, types={"parser_status"})
+    event_bus.start()
     
-    async def message_handler(msg):
-        data = msg.data.decode()
-        print(f"NATS msg: {data}")
+    async def message_handler(data: dict, seq: int | None):
+        print(f"NATS msg: {data.get('type')} {data.get('message', '')}")
+        # Сохранение в любом воркере делает кэш ответов устаревшим
+        if data.get("type") in ("products_saved", "removed"):
+            response_cache.bump()
+        if seq is not None:
+            data["seq"] = seq  # номер в потоке JetStream для replay после переподключения
         await manager_ws.broadcast(data)
     
-    await nc.subscribe("products.updates", cb=message_handler)
-    await nc.publish("products.updates", json.dumps({"type": "system", "message": "NATS подключен"}, ensure_ascii=False).encode())
+    await nats_service.subscribe_updates(message_handler)
+    # Правила отслеживания проверяются по событиям из NATS, а не из шины
+    # событий, чтобы учитывать и сохранения из воркеров; каждое событие
+    # сопоставляет только одна реплика API
+    await watch_engine.listen()
+    await nats_service.publish(NATS_UPDATES_SUBJECT, {"type": "system", "message": "NATS подключен"})
     
     # Запуск планировщика
     await start_scheduler()
@@ -66,6 +91,9 @@ async def on_startup():
 @app.on_event("shutdown")
 async def on_shutdown():
     await shutdown_scheduler()
+    await browser_pool.stop()
+    await event_bus.stop()
+    await nats_service.close()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
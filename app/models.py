@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from datetime import datetime
 
 class TaskModel(SQLModel, table=True):
@@ -10,9 +11,69 @@ class TaskModel(SQLModel, table=True):
 
 class ProductModel(SQLModel, table=True):
     __tablename__ = "products"
+    # Составные индексы под keyset-пагинацию /products/last и /products/top-discount
+    __table_args__ = (
+        Index("ix_products_created_at_id", "created_at", "id"),
+        Index("ix_products_discount_id", "discount", "id"),
+        Index("ix_products_price_kopecks_id", "price_kopecks", "id"),
+    )
     id: int | None = Field(primary_key=True)
     name: str
     price: str
-    link: str
+    link: str = Field(index=True, unique=True)
     discount: float = 0.0  # Добавьте поле для скидки
-    created_at: datetime = Field(default_factory=lambda: datetime.now())
\ No newline at end of file
+    # Числовые поля из текста цены, см. price_service.normalize_price
+    price_kopecks: int | None = None
+    old_price_kopecks: int | None = None
+    currency: str | None = None
+    # Хэш отслеживаемых полей: по нему парсер понимает, изменился ли товар
+    content_hash: str | None = None
+    category: str | None = Field(default=None, index=True)
+    delisted_at: datetime | None = None  # товар пропал из выдачи категории
+    missed_crawls: int | None = 0  # полных обходов подряд, в которых товара не было
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+
+class PriceHistoryModel(SQLModel, table=True):
+    """Изменения цены и скидки товара; строка пишется только при изменении"""
+    __tablename__ = "price_history"
+    __table_args__ = (
+        Index("ix_price_history_product_recorded", "product_id", "recorded_at"),
+    )
+    id: int | None = Field(primary_key=True)
+    product_id: int = Field(foreign_key="products.id")
+    price_kopecks: int | None = None
+    discount: float = 0.0
+    recorded_at: datetime = Field(default_factory=lambda: datetime.now())
+
+class ProductStatsModel(SQLModel, table=True):
+    """Сводная статистика по товарам: одна строка, обновляется в транзакции сохранения"""
+    __tablename__ = "product_stats"
+    id: int | None = Field(default=None, primary_key=True)
+    total: int = 0
+    last_update: datetime | None = None
+    last_product_name: str | None = None
+    last_product_price: str | None = None
+    last_product_link: str | None = None
+    # Распределение скидок, см. stats_service.DISCOUNT_BUCKETS
+    discount_none: int = 0
+    discount_lt_10: int = 0
+    discount_10_30: int = 0
+    discount_30_50: int = 0
+    discount_50_plus: int = 0
+    # Цены в копейках; среднее = price_sum_kopecks / price_count
+    price_count: int = 0
+    price_sum_kopecks: int = 0
+    price_min_kopecks: int | None = None
+    price_max_kopecks: int | None = None
+
+class WatchRuleModel(SQLModel, table=True):
+    """Правило отслеживания пользователя Telegram, см. watch_service"""
+    __tablename__ = "watch_rules"
+    __table_args__ = (
+        Index("ix_watch_rules_user_kind_value", "user_id", "kind", "value", unique=True),
+    )
+    id: int | None = Field(primary_key=True)
+    user_id: int = Field(index=True)  # chat id пользователя
+    kind: str  # "link", "keyword" или "discount"
+    value: str  # ссылка, ключевые слова или порог скидки в процентах
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
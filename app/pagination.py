@@ -0,0 +1,57 @@
+from fastapi import HTTPException
+from sqlalchemy import DateTime, and_, or_
+from datetime import datetime
+import base64
+import json
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: list) -> str:
+    """Упаковывает значения ключа сортировки последней строки в непрозрачный курсор"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _is_datetime(column) -> bool:
+    # TypeDecorator'ы (например, у SQLModel) хранят исходный тип в impl
+    return isinstance(getattr(column.type, "impl", column.type), DateTime)
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("cursor shape mismatch")
+        return [
+            datetime.fromisoformat(value) if value is not None and _is_datetime(column) else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_paginate(stmt, columns: list, cursor: str | None, limit: int, descending: bool = False):
+    """Добавляет к запросу стабильную сортировку и условие keyset-пагинации.
+
+    `columns` — ключ сортировки, последним должен идти уникальный столбец
+    (обычно id). Вместо OFFSET запрос продолжает с позиции из курсора, так
+    что глубокие страницы читаются по индексу так же быстро, как первая.
+    """
+    order = [column.desc() if descending else column.asc() for column in columns]
+    stmt = stmt.order_by(*order).limit(limit)
+    if not cursor:
+        return stmt
+    
+    values = decode_cursor(cursor, columns)
+    conditions = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        prefix = [c == v for c, v in zip(columns[:i], values[:i])]
+        step = column < value if descending else column > value
+        conditions.append(and_(*prefix, step))
+    return stmt.where(or_(*conditions))
+
+def next_cursor(rows: list, columns: list, limit: int) -> str | None:
+    """Курсор следующей страницы или None, если страница неполная"""
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor([getattr(last, column.key) for column in columns])
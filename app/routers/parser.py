@@ -1,11 +1,70 @@
-from fastapi import APIRouter, BackgroundTasks
-from app.services.parser_service import OzonParser
+from fastapi import APIRouter, HTTPException
+from app.services.parser_service import get_category_urls, PARSER_CONCURRENCY
+from app.services.job_service import job_registry
+from app.scheduler import enqueue_categories, PARSER_USE_WORKERS
+from app.schemas import ParserBatch
 
 router = APIRouter(prefix="/parser", tags=["parser"])
 
+async def enqueue_response(category_urls: list[str]) -> dict:
+    """Режим воркеров: категории уходят в очередь NATS, а не парсятся в этой реплике"""
+    enqueued = await enqueue_categories(category_urls, manual=True)
+    return {
+        "message": "Категории поставлены в очередь воркеров",
+        "categories": category_urls,
+        "enqueued": enqueued
+    }
+
 @router.get("")
-async def parser(background_task: BackgroundTasks):
-    ozon_parser = OzonParser()
-    category_url = "https://www.ozon.ru/category/nastolnye-igry-13507/"  
-    background_task.add_task(ozon_parser.start, category_url)
-    return {"message": "Парсер успешно запущен в фоне"}
\ No newline at end of file
+async def parser():
+    category_urls = get_category_urls()
+    if PARSER_USE_WORKERS:
+        return await enqueue_response(category_urls)
+    jobs = job_registry.submit_many(category_urls)
+    return {
+        "message": "Парсер успешно запущен в фоне",
+        "categories": category_urls,
+        "jobs": [job.id for job in jobs]
+    }
+
+@router.post("/batch")
+async def parser_batch(batch: ParserBatch):
+    """Запустить парсинг списка категорий с ограничением параллельности"""
+    category_urls = list(dict.fromkeys(url.strip() for url in batch.urls if url.strip()))
+    if not category_urls:
+        raise HTTPException(status_code=400, detail="Category list is empty")
+    if any(not url.startswith(("http://", "https://")) for url in category_urls):
+        raise HTTPException(status_code=400, detail="Category URLs must be absolute http(s) links")
+    
+    if PARSER_USE_WORKERS:
+        # Параллельность задают воркеры (их PARSER_CONCURRENCY)
+        return await enqueue_response(category_urls)
+    concurrency = batch.concurrency or PARSER_CONCURRENCY
+    jobs = job_registry.submit_many(category_urls, concurrency)
+    return {
+        "message": "Парсинг категорий запущен в фоне",
+        "categories": category_urls,
+        "concurrency": concurrency,
+        "jobs": [job.id for job in jobs]
+    }
+
+@router.get("/jobs")
+async def get_jobs(active: bool = False):
+    """Задания парсера этого процесса, новые первыми"""
+    return [job.to_dict() for job in job_registry.list() if job.active or not active]
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Статус и прогресс задания парсера"""
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Отменить задание парсера"""
+    job = job_registry.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -1,78 +1,167 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy import select, func
-from app.database import get_db, DBSession
-from app.models import ProductModel
-from app.schemas import Product
+from fastapi import APIRouter, HTTPException, Depends, Response
+from sqlalchemy import select
+from app.database import get_read_db, DBSession
+from app.models import ProductModel, PriceHistoryModel, ProductStatsModel
+from app.schemas import ProductRead, PriceHistoryEntry
+from app.pagination import keyset_paginate, next_cursor, NEXT_CURSOR_HEADER
+from app.services.cache_service import response_cache
+from app.services.stats_service import stats_to_dict, STATS_ID
+from app.services.search_service import search_products
 
 router = APIRouter(prefix="/products", tags=["products"])
 
-@router.get("", response_model=list[Product])
+# Параметр sort -> ключ keyset-пагинации; "-" перед именем — по убыванию
+SORT_KEYS = {
+    "id": [ProductModel.id],
+    "price": [ProductModel.price_kopecks, ProductModel.id],
+    "discount": [ProductModel.discount, ProductModel.id],
+    "created_at": [ProductModel.created_at, ProductModel.id],
+}
+
+def set_next_cursor(response: Response, rows: list, columns: list, limit: int):
+    cursor = next_cursor(rows, columns, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+async def cached_page(key: tuple, response: Response, db: DBSession, columns: list, cursor: str | None, limit: int):
+    """Страница товаров по убыванию `columns` через кэш ответов"""
+    async def load():
+        # Снятые с продажи товары в выдачу не попадают, как и в /products/stats
+        listed = select(ProductModel).where(ProductModel.delisted_at.is_(None))
+        stmt = keyset_paginate(listed, columns, cursor, limit, descending=True)
+        result = await db.execute(stmt)
+        products = result.scalars().all()
+        return [product.model_dump() for product in products], next_cursor(products, columns, limit)
+    
+    products, page_cursor = await response_cache.get_or_load(key, load)
+    if page_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page_cursor
+    return products
+
+@router.get("", response_model=list[ProductRead])
 async def get_products(
+    response: Response,
     limit: int = 100,
     offset: int = 0,
-    db: DBSession = Depends(get_db)
+    cursor: str | None = None,
+    sort: str = "id",
+    min_price: float | None = None,
+    max_price: float | None = None,
+    min_discount: float | None = None,
+    currency: str | None = None,
+    include_delisted: bool = False,
+    db: DBSession = Depends(get_read_db)
 ):
-    """Получить список товаров"""
-    stmt = select(ProductModel).offset(offset).limit(limit)
+    """Получить список товаров.
+
+    `sort` — id, price, discount или created_at, с "-" по убыванию; цены
+    фильтров в рублях. Следующую страницу отдает курсор из заголовка
+    X-Next-Cursor (он действителен только для того же `sort`); `offset`
+    оставлен для совместимости и игнорируется вместе с `cursor`.
+    Снятые с продажи товары возвращаются только с `include_delisted=true`.
+    """
+    descending = sort.startswith("-")
+    columns = SORT_KEYS.get(sort.lstrip("-"))
+    if columns is None:
+        raise HTTPException(status_code=400, detail=f"Unknown sort, use one of: {', '.join(SORT_KEYS)}")
+    
+    stmt = select(ProductModel)
+    if not include_delisted:
+        stmt = stmt.where(ProductModel.delisted_at.is_(None))
+    if sort.lstrip("-") == "price":
+        # Товары без цены в сортировку по цене не попадают
+        stmt = stmt.where(ProductModel.price_kopecks.is_not(None))
+    if min_price is not None:
+        stmt = stmt.where(ProductModel.price_kopecks >= round(min_price * 100))
+    if max_price is not None:
+        stmt = stmt.where(ProductModel.price_kopecks <= round(max_price * 100))
+    if min_discount is not None:
+        stmt = stmt.where(ProductModel.discount >= min_discount)
+    if currency:
+        stmt = stmt.where(ProductModel.currency == currency.upper())
+    
+    stmt = keyset_paginate(stmt, columns, cursor, limit, descending=descending)
+    if offset and not cursor:
+        stmt = stmt.offset(offset)
     res = await db.execute(stmt)
     products = res.scalars().all()
+    set_next_cursor(response, products, columns, limit)
     return products
 
 @router.get("/stats")
-async def get_products_stats(db: DBSession = Depends(get_db)):
-    """Получить статистику по товарам"""
-    stmt = select(func.count(ProductModel.id))
-    result = await db.execute(stmt)
-    total = result.scalar() or 0
-    
-    if total == 0:
-        return {
-            "total": 0,
-            "last_update": None,
-            "last_product": None
-        }
+async def get_products_stats(db: DBSession = Depends(get_read_db)):
+    """Получить статистику по товарам из сводной таблицы (без COUNT по товарам)"""
+    async def load():
+        return stats_to_dict(await db.get(ProductStatsModel, STATS_ID))
     
-    # Последний товар
-    stmt_last = select(ProductModel).order_by(ProductModel.created_at.desc()).limit(1)
-    result_last = await db.execute(stmt_last)
-    last_product = result_last.scalar_one_or_none()
-    
-    return {
-        "total": total,
-        "last_update": last_product.created_at.isoformat() if last_product else None,
-        "last_product": {
-            "name": last_product.name if last_product else None,
-            "price": last_product.price if last_product else None,
-            "link": last_product.link if last_product else None
-        } if last_product else None
-    }
+    return await response_cache.get_or_load(("stats",), load)
 
 @router.get("/last")
 async def get_last_products(
+    response: Response,
     limit: int = 5,
-    db: DBSession = Depends(get_db)
+    cursor: str | None = None,
+    db: DBSession = Depends(get_read_db)
 ):
     """Получить последние товары"""
-    stmt = select(ProductModel).order_by(ProductModel.created_at.desc()).limit(limit)
-    result = await db.execute(stmt)
-    products = result.scalars().all()
-    return products
+    columns = [ProductModel.created_at, ProductModel.id]
+    return await cached_page(("last", limit, cursor), response, db, columns, cursor, limit)
 
 @router.get("/top-discount")
 async def get_top_products_with_discount(
+    response: Response,
     limit: int = 10,
-    db: DBSession = Depends(get_db)
+    cursor: str | None = None,
+    db: DBSession = Depends(get_read_db)
 ):
     """Получить топ товаров с наибольшей скидкой"""
-    stmt = select(ProductModel).order_by(ProductModel.discount.desc()).limit(limit)
-    result = await db.execute(stmt)
-    products = result.scalars().all()
-    return products
+    columns = [ProductModel.discount, ProductModel.id]
+    return await cached_page(("top-discount", limit, cursor), response, db, columns, cursor, limit)
+
+@router.get("/search", response_model=list[ProductRead])
+async def search(
+    q: str,
+    min_discount: float | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    limit: int = 20,
+    include_delisted: bool = False,
+    db: DBSession = Depends(get_read_db)
+):
+    """Полнотекстовый поиск по названию: слова ищутся по префиксу, цены в рублях"""
+    return await search_products(
+        db, q,
+        min_discount=min_discount,
+        min_price_kopecks=round(min_price * 100) if min_price is not None else None,
+        max_price_kopecks=round(max_price * 100) if max_price is not None else None,
+        limit=limit,
+        include_delisted=include_delisted
+    )
 
-@router.get("/{product_id}", response_model=Product)
-async def get_product(product_id: int, db: DBSession = Depends(get_db)):
+@router.get("/{product_id}", response_model=ProductRead)
+async def get_product(product_id: int, db: DBSession = Depends(get_read_db)):
     """Получить товар по ID"""
     product = await db.get(ProductModel, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
\ No newline at end of file
+    return product
+
+@router.get("/{product_id}/history", response_model=list[PriceHistoryEntry])
+async def get_product_price_history(
+    product_id: int,
+    limit: int = 100,
+    db: DBSession = Depends(get_read_db)
+):
+    """Получить историю изменения цены и скидки товара"""
+    product = await db.get(ProductModel, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    stmt = (
+        select(PriceHistoryModel)
+        .where(PriceHistoryModel.product_id == product_id)
+        .order_by(PriceHistoryModel.recorded_at.desc())
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().all()
@@ -1,19 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends, Response
 from sqlalchemy import select
-from app.database import get_db, DBSession
+from app.database import get_db, get_read_db, DBSession
 from app.models import TaskModel
 from app.schemas import Task, TaskCreate, TaskUpdate
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
 @router.get("", response_model=list[TaskModel])
-async def get_tasks(db: DBSession = Depends(get_db)):
+async def get_tasks(db: DBSession = Depends(get_read_db)):
     stmt = select(TaskModel)
     res = await db.execute(stmt)
     return res.scalars()
 
 @router.get("/{task_id}", response_model=Task)
-async def get_task(task_id: int, db: DBSession = Depends(get_db)):
+async def get_task(task_id: int, db: DBSession = Depends(get_read_db)):
     task = await db.get(TaskModel, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
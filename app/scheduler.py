@@ -1,43 +1,69 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from app.database import engine
-from app.models import ProductModel
-from sqlalchemy import delete
-from sqlalchemy.ext.asyncio import AsyncSession
-import asyncio
+import os
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+PARSER_INTERVAL_MINUTES = int(os.getenv("PARSER_INTERVAL_MINUTES", "10"))
+# true — API только ставит задания в очередь NATS, парсят воркеры (python worker.py)
+PARSER_USE_WORKERS = os.getenv("PARSER_USE_WORKERS", "false").lower() in ("1", "true", "yes")
+MANUAL_JOB_SLOT = 60  # сек, в течение которых повторный ручной запуск категории схлопывается
 
 scheduler = AsyncIOScheduler()
 
-async def clear_products_table():
-    """Очищает таблицу товаров перед новым парсингом"""
-    async with AsyncSession(engine) as session:
-        try:
-            await session.execute(delete(ProductModel))
-            await session.commit()
-            print("Таблица товаров очищена")
-        except Exception as e:
-            await session.rollback()
-            print(f"Ошибка при очистке таблицы: {e}")
-
-def run_parser():
-    """Запускает парсер с очисткой таблицы"""
-    from app.services.parser_service import OzonParser
+async def enqueue_categories(category_urls: list[str], manual: bool = False) -> list[str]:
+    """Ставит категории в очередь воркеров; возвращает реально добавленные.
+
+    Id задания — категория и номер интервала планировщика, так что все
+    реплики API в одном интервале ставят одно и то же задание, а JetStream
+    отбрасывает повторы. Ручные запуски (/parser, Telegram) не должны
+    ждать следующего интервала, поэтому у них свой id с минутным слотом:
+    повторные нажатия в течение минуты схлопываются.
+    """
+    from app.services.nats_service import nats_service
+    
+    if manual:
+        prefix, slot = "manual", int(time.time() // MANUAL_JOB_SLOT)
+    else:
+        prefix, slot = "scrape", int(time.time() // (PARSER_INTERVAL_MINUTES * 60))
+    enqueued = []
+    for url in category_urls:
+        if await nats_service.enqueue_job({"category": url}, f"{prefix}:{url}:{slot}"):
+            enqueued.append(url)
+    print(f"Заданий парсера в очереди: {len(enqueued)} из {len(category_urls)}")
+    return enqueued
+
+async def run_parser():
+    """Запускает парсер по всем категориям; товары обновляются по ссылке"""
+    from app.services.parser_service import get_category_urls
+    from app.services.job_service import job_registry
     
-    # Очищаем таблицу перед парсингом
-    new_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(new_loop)
-    try:
-        new_loop.run_until_complete(clear_products_table())
-    finally:
-        new_loop.close()
+    if PARSER_USE_WORKERS:
+        await enqueue_categories(get_category_urls())
+        return
+    # Запускаем парсер в том же event loop, что и приложение; категории,
+    # которые уже парсятся по другому запуску, не дублируются
+    await job_registry.wait(job_registry.submit_many(get_category_urls(), source="scheduler"))
+
+def check_jobs_dedupe_window():
+    """Окно дедупликации JetStream должно покрывать интервал планировщика.
+
+    Id задания меняется раз в интервал, и реплики ставят его в разные
+    моменты интервала; если окно короче, второе задание не отбросится.
+    """
+    from app.services.nats_service import NATS_JOBS_DEDUPE_WINDOW
     
-    # Запускаем парсер
-    ozon_parser = OzonParser()
-    category_url = "https://www.ozon.ru/category/nastolnye-igry-13507/"
-    ozon_parser.start(category_url)
+    if NATS_JOBS_DEDUPE_WINDOW < PARSER_INTERVAL_MINUTES * 60:
+        raise ValueError(
+            f"NATS_JOBS_DEDUPE_WINDOW ({NATS_JOBS_DEDUPE_WINDOW:g} сек) меньше интервала планировщика "
+            f"PARSER_INTERVAL_MINUTES ({PARSER_INTERVAL_MINUTES} мин): реплики будут дублировать задания"
+        )
 
 async def start_scheduler():
+    if PARSER_USE_WORKERS:
+        check_jobs_dedupe_window()
     scheduler.start()
-    scheduler.add_job(run_parser, 'interval', minutes=10)
+    scheduler.add_job(run_parser, 'interval', minutes=PARSER_INTERVAL_MINUTES)
 
 async def shutdown_scheduler():
-    scheduler.shutdown()
\ No newline at end of file
+    scheduler.shutdown()
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from datetime import datetime
 
 class TaskCreate(BaseModel):
     title: str
@@ -16,4 +17,21 @@ class Product(BaseModel):
     name: str
     price: str
     link: str
-    discount: float = 0.0
\ No newline at end of file
+    discount: float = 0.0
+    price_kopecks: int | None = None
+    old_price_kopecks: int | None = None
+    currency: str | None = None
+
+class ProductRead(Product):
+    """Товар в ответах API: id нужен для /products/{id}/history"""
+    id: int
+    delisted_at: datetime | None = None  # снят с продажи (виден с include_delisted=true)
+
+class ParserBatch(BaseModel):
+    urls: list[str]
+    concurrency: int | None = None
+
+class PriceHistoryEntry(BaseModel):
+    price_kopecks: int | None
+    discount: float
+    recorded_at: datetime
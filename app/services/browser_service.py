@@ -0,0 +1,157 @@
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright
+from contextlib import asynccontextmanager
+import asyncio
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_CONTEXT_MAX_USES = int(os.getenv("BROWSER_CONTEXT_MAX_USES", "20"))
+BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "false").lower() in ("1", "true", "yes")
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+WEBDRIVER_INIT_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+
+class PooledContext:
+    """Прогретый контекст браузера с одной страницей и счетчиком использований"""
+
+    def __init__(self, context: BrowserContext, page: Page):
+        self.context = context
+        self.page = page
+        self.uses = 0
+        self.broken = False
+
+    async def close(self):
+        try:
+            await self.context.close()
+        except Exception as e:
+            print(f"Ошибка при закрытии контекста браузера: {e}")
+
+
+class BrowserPool:
+    """Долгоживущий Chromium с пулом прогретых контекстов.
+
+    Браузер запускается один раз при старте приложения, а парсеры берут
+    готовые страницы через `async with browser_pool.page()`. Контекст
+    пересоздается после `max_uses` использований или если он перестал
+    отвечать.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_CONTEXT_MAX_USES,
+                 headless: bool = BROWSER_HEADLESS):
+        self.size = size
+        self.max_uses = max_uses
+        self.headless = headless
+        self._playwright: Playwright | None = None
+        self._browser: Browser | None = None
+        self._idle: list[PooledContext] = []
+        self._semaphore = asyncio.Semaphore(size)
+        self._lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def start(self):
+        """Запускает браузер и прогревает контексты"""
+        async with self._lock:
+            if self.started:
+                return
+            await self._launch()
+            for _ in range(self.size):
+                self._idle.append(await self._new_context())
+            print(f"✅ Пул браузера запущен: {self.size} контекстов")
+
+    async def stop(self):
+        """Закрывает все контексты, браузер и playwright"""
+        async with self._lock:
+            for item in self._idle:
+                await item.close()
+            self._idle.clear()
+            if self._browser:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    print(f"Ошибка при закрытии браузера: {e}")
+                self._browser = None
+            if self._playwright:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def _launch(self):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=self.headless,
+            args=['--disable-blink-features=AutomationControlled']
+        )
+
+    async def _new_context(self) -> PooledContext:
+        context = await self._browser.new_context(
+            user_agent=USER_AGENT,
+            locale='ru-RU',
+            extra_http_headers={'Accept-Language': 'ru-RU,ru;q=0.9'}
+        )
+        await context.add_init_script(WEBDRIVER_INIT_SCRIPT)
+        page = await context.new_page()
+        return PooledContext(context, page)
+
+    async def _is_healthy(self, item: PooledContext) -> bool:
+        if item.broken or item.uses >= self.max_uses:
+            return False
+        if not self.started or item.page.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(item.page.evaluate("1"), timeout=5)
+        except Exception:
+            return False
+        return True
+
+    async def _acquire(self) -> PooledContext:
+        async with self._lock:
+            if not self.started:
+                # Браузер упал или пул еще не запускали — поднимаем заново
+                for item in self._idle:
+                    await item.close()
+                self._idle.clear()
+                await self._launch()
+            while self._idle:
+                item = self._idle.pop()
+                if await self._is_healthy(item):
+                    return item
+                await item.close()
+            return await self._new_context()
+
+    async def _release(self, item: PooledContext):
+        item.uses += 1
+        if await self._is_healthy(item):
+            try:
+                await item.page.goto("about:blank")
+                self._idle.append(item)
+                return
+            except Exception:
+                pass
+        await item.close()
+        # Сразу подменяем выбывший контекст новым, чтобы пул оставался прогретым
+        if self.started:
+            try:
+                self._idle.append(await self._new_context())
+            except Exception as e:
+                print(f"Ошибка при создании контекста браузера: {e}")
+
+    @asynccontextmanager
+    async def page(self):
+        """Выдает прогретую страницу; одновременно не больше `size` страниц"""
+        async with self._semaphore:
+            item = await self._acquire()
+            try:
+                yield item.page
+            except BaseException:
+                item.broken = True
+                raise
+            finally:
+                await self._release(item)
+
+
+browser_pool = BrowserPool()
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+import time
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))  # секунд
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+_MISSING = object()
+
+
+class ResponseCache:
+    """TTL + LRU кэш ответов read-эндпоинтов с поколением данных.
+
+    Каждое сохранение товаров увеличивает `generation`, и все записи
+    предыдущего поколения перестают считаться валидными. TTL страхует от
+    пропущенного сигнала (например, если NATS был недоступен).
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: OrderedDict[tuple, tuple[int, float, object]] = OrderedDict()
+
+    def bump(self):
+        """Данные изменились — сбрасываем кэш"""
+        self.generation += 1
+        self._entries.clear()
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        generation, expires_at, value = entry
+        if generation != self.generation or expires_at < time.monotonic():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: tuple, value, generation: int | None = None):
+        generation = self.generation if generation is None else generation
+        if generation != self.generation:
+            # Пока считали ответ, данные успели обновиться
+            return
+        self._entries[key] = (generation, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key: tuple, loader):
+        """Возвращает значение из кэша или вызывает async `loader()` и кэширует результат"""
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+        generation = self.generation
+        value = await loader()
+        self.set(key, value, generation)
+        return value
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Awaitable, Callable
+
+EVENT_QUEUE_SIZE = 10000
+EVENT_DRAIN_TIMEOUT = 5.0  # сек на доставку оставшихся событий при остановке
+
+Sink = Callable[[dict], Awaitable[None]]
+
+
+class EventBus:
+    """Шина событий приложения.
+
+    `publish` можно вызывать из любого потока: событие попадает в очередь
+    основного event loop через `call_soon_threadsafe`, а единственный
+    диспетчер раздает его подписанным приемникам (WebSocket, NATS, Telegram).
+    Сокеты и соединения приемников так используются только из своего loop.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[dict] | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._sinks: list[tuple[Sink, set[str] | None]] = []
+
+    def subscribe(self, sink: Sink, types: set[str] | None = None):
+        """Добавляет приемник событий; `types` — какие type получать (None — все)"""
+        self._sinks.append((sink, types))
+
+    def start(self):
+        """Привязывает шину к текущему event loop и запускает диспетчер"""
+        if self._dispatcher and not self._dispatcher.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        """Доставляет накопленные события и останавливает диспетчер"""
+        if not self._dispatcher:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), EVENT_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Не доставлено событий при остановке: {self._queue.qsize()}")
+        self._dispatcher.cancel()
+        self._dispatcher = None
+        self._loop = None
+
+    def publish(self, event: dict):
+        """Публикует событие из любого потока, не дожидаясь доставки"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            print(f"Шина событий не запущена, событие {event.get('type')} пропущено")
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None  # вызов из потока без event loop
+        if running is loop:
+            self._put(event)
+        else:
+            loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            print(f"Очередь событий переполнена, событие {event.get('type')} пропущено")
+
+    async def _dispatch(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                sinks = [sink for sink, types in self._sinks if types is None or event.get("type") in types]
+                results = await asyncio.gather(*(sink(event) for sink in sinks), return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        print(f"Ошибка доставки события {event.get('type')}: {result}")
+            finally:
+                self._queue.task_done()
+
+
+event_bus = EventBus()
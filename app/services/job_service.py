@@ -0,0 +1,131 @@
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.services.parser_service import OzonParser, PARSER_CONCURRENCY
+
+PARSER_JOB_HISTORY = int(os.getenv("PARSER_JOB_HISTORY", "100"))  # сколько завершенных заданий помнить
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class ParserJob:
+    """Парсинг одной категории: статус, прогресс и задача asyncio"""
+
+    def __init__(self, category: str, source: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.category = category
+        self.source = source
+        self.status = "queued"
+        self.error: str | None = None
+        self.requests = 1  # сколько запусков схлопнулось в это задание
+        self.created_at = datetime.now()
+        self.started_at: datetime | None = None
+        self.finished_at: datetime | None = None
+        self.parser: OzonParser | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def to_dict(self) -> dict:
+        parser = self.parser
+        return {
+            "id": self.id,
+            "category": self.category,
+            "source": self.source,
+            "status": self.status,
+            "error": self.error,
+            "requests": self.requests,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "progress": {
+                "scrolls": parser.scrolls if parser else 0,
+                "products_found": parser.found if parser else 0,
+                "products_saved": parser.saved if parser else 0
+            }
+        }
+
+
+class JobRegistry:
+    """Реестр заданий парсера процесса.
+
+    /parser, кнопка в Telegram и планировщик запускают парсинг только через
+    реестр: повторный запуск категории, которая уже в очереди или парсится,
+    возвращает существующее задание вместо нового браузера.
+    """
+
+    def __init__(self, history: int = PARSER_JOB_HISTORY):
+        self.history = history
+        self._jobs: OrderedDict[str, ParserJob] = OrderedDict()
+        self._active: dict[str, ParserJob] = {}
+
+    def submit(self, category: str, source: str = "api", semaphore: asyncio.Semaphore | None = None) -> ParserJob:
+        job = self._active.get(category)
+        if job is not None:
+            job.requests += 1
+            print(f"Категория уже парсится, запуск присоединен к заданию {job.id}")
+            return job
+
+        job = ParserJob(category, source)
+        self._active[category] = job
+        self._jobs[job.id] = job
+        self._trim()
+        job.task = asyncio.create_task(self._run(job, semaphore or asyncio.Semaphore(PARSER_CONCURRENCY)))
+        return job
+
+    def submit_many(self, categories: list[str], concurrency: int = PARSER_CONCURRENCY,
+                    source: str = "api") -> list[ParserJob]:
+        """Задания для списка категорий; новые из них идут не больше `concurrency` одновременно"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        return [self.submit(category, source, semaphore) for category in dict.fromkeys(categories)]
+
+    async def wait(self, jobs: list[ParserJob]):
+        """Дожидается завершения заданий (в том числе отмененных)"""
+        await asyncio.gather(*(asyncio.shield(job.task) for job in jobs), return_exceptions=True)
+
+    def get(self, job_id: str) -> ParserJob | None:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[ParserJob]:
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> ParserJob | None:
+        job = self._jobs.get(job_id)
+        if job is not None and job.active:
+            job.task.cancel()
+        return job
+
+    async def _run(self, job: ParserJob, semaphore: asyncio.Semaphore):
+        try:
+            async with semaphore:
+                job.status = "running"
+                job.started_at = datetime.now()
+                job.parser = OzonParser()
+                await job.parser.start(job.category)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            print(f"Задание {job.id} ({job.category}) отменено")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Ошибка при парсинге категории {job.category}: {e}")
+        finally:
+            job.finished_at = datetime.now()
+            self._active.pop(job.category, None)
+
+    def _trim(self):
+        """Забывает самые старые завершенные задания сверх `history`"""
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+
+job_registry = JobRegistry()
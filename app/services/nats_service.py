@@ -0,0 +1,301 @@
+import nats
+from nats.js.api import AckPolicy, ConsumerConfig, DeliverPolicy, RetentionPolicy, StreamConfig
+from nats.errors import TimeoutError as NatsTimeoutError
+from nats.js.errors import BadRequestError
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable
+from app.scheduler import PARSER_INTERVAL_MINUTES
+from dotenv import load_dotenv
+load_dotenv()
+
+NATS_URL = os.getenv("NATS_URL", "nats://127.0.0.1:4222")
+NATS_UPDATES_SUBJECT = "products.updates"
+NATS_BATCH_SIZE = int(os.getenv("NATS_BATCH_SIZE", "100"))  # товаров в одном сообщении products_saved
+NATS_FLUSH_INTERVAL = float(os.getenv("NATS_FLUSH_INTERVAL", "1.0"))  # сек между отправками накопленных товаров
+NATS_JETSTREAM = os.getenv("NATS_JETSTREAM", "false").lower() in ("1", "true", "yes")
+NATS_STREAM = os.getenv("NATS_STREAM", "PRODUCTS")
+NATS_STREAM_MAX_AGE = float(os.getenv("NATS_STREAM_MAX_AGE", str(24 * 3600)))  # сек хранения событий в потоке
+NATS_REPLAY_LIMIT = int(os.getenv("NATS_REPLAY_LIMIT", "1000"))  # максимум сообщений за один replay
+
+# Очередь заданий парсера для воркеров (JetStream, work queue)
+NATS_JOBS_STREAM = os.getenv("NATS_JOBS_STREAM", "PARSER_JOBS")
+NATS_JOBS_SUBJECT = "parser.jobs"
+NATS_JOBS_CONSUMER = "parser-workers"
+# Сек, в течение которых повтор задания отбрасывается; должно быть не меньше
+# интервала планировщика, иначе реплики ставят одно задание дважды
+NATS_JOBS_DEDUPE_WINDOW = float(os.getenv("NATS_JOBS_DEDUPE_WINDOW", str(PARSER_INTERVAL_MINUTES * 60)))
+PARSER_JOB_ACK_WAIT = float(os.getenv("PARSER_JOB_ACK_WAIT", "120"))  # аренда задания воркером, сек
+PARSER_JOB_MAX_DELIVER = int(os.getenv("PARSER_JOB_MAX_DELIVER", "3"))  # попыток выполнить задание
+
+MessageHandler = Callable[[dict, int | None], Awaitable[None]]
+
+
+class ProductsBuffer:
+    """Накопленные события products_saved одной категории.
+
+    Товары схлопываются по ссылке (последнее состояние выигрывает, но
+    previous_* — с первого сохранения, чтобы правила отслеживания видели
+    изменение целиком), счетчики складываются — подписчики получают одно
+    сообщение на пачку вместо сообщения на каждое сохранение.
+    """
+
+    def __init__(self, category: str | None):
+        self.category = category
+        self.products: dict[str, dict] = {}
+        self.counts = {"count": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+
+    def add(self, event: dict):
+        for key in self.counts:
+            self.counts[key] += event.get(key) or 0
+        for product in event.get("products") or []:
+            earlier = self.products.get(product["link"])
+            if earlier is not None:
+                # Товар, новый в первом сохранении, остается новым
+                product = {key: value for key, value in product.items() if not key.startswith("previous_")}
+                product.update((key, value) for key, value in earlier.items() if key.startswith("previous_"))
+            self.products[product["link"]] = product
+
+    def to_messages(self, chunk_size: int) -> list[dict]:
+        products = list(self.products.values())
+        chunks = [products[i:i + chunk_size] for i in range(0, len(products), chunk_size)] or [[]]
+        message = (
+            f"Сохранено {self.counts['count']} товаров в БД: новых {self.counts['inserted']}, "
+            f"обновлено {self.counts['updated']}, без изменений {self.counts['unchanged']}"
+        )
+        return [{
+            "type": "products_saved",
+            "category": self.category,
+            **self.counts,
+            "message": message,
+            "chunk": index,
+            "chunks": len(chunks),
+            "products": chunk
+        } for index, chunk in enumerate(chunks, 1)]
+
+
+class NatsService:
+    """Одно соединение с NATS на процесс и публикация событий товаров.
+
+    События products_saved копятся в буфере и уходят раз в
+    NATS_FLUSH_INTERVAL секунд сообщениями по NATS_BATCH_SIZE товаров.
+    С NATS_JETSTREAM=true сообщения пишутся в поток NATS_STREAM, и
+    подписчик, подключившийся позже, может дочитать их с нужного номера.
+    """
+
+    def __init__(self):
+        self.nc = None
+        self.js = None
+        self._buffers: dict[str | None, ProductsBuffer] = {}
+        self._flusher: asyncio.Task | None = None
+        self._early_flush: asyncio.Task | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self.nc is not None and self.nc.is_connected
+
+    async def connect(self, url: str = NATS_URL):
+        if self.connected:
+            return
+        self.nc = await nats.connect(url)
+        if NATS_JETSTREAM:
+            self.js = self.nc.jetstream()
+            await self._ensure_stream()
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        print(f"✅ NATS подключен: {url}" + (f", поток {NATS_STREAM}" if self.js else ""))
+
+    async def _ensure_stream(self):
+        config = StreamConfig(
+            name=NATS_STREAM,
+            subjects=["products.>"],
+            max_age=NATS_STREAM_MAX_AGE
+        )
+        try:
+            await self.js.add_stream(config)
+        except BadRequestError:
+            # Поток уже есть с другими настройками
+            await self.js.update_stream(config)
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        if self.nc:
+            await self.flush()
+            await self.nc.drain()
+            self.nc = None
+            self.js = None
+
+    async def publish(self, subject: str, data: dict) -> int | None:
+        """Публикует событие сразу; возвращает номер в потоке JetStream"""
+        if not self.connected:
+            return None
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        try:
+            if self.js:
+                ack = await self.js.publish(subject, payload)
+                return ack.seq
+            await self.nc.publish(subject, payload)
+        except Exception as e:
+            print(f" Ошибка публикации в NATS: {e}")
+        return None
+
+    def add_products(self, event: dict):
+        """Кладет событие products_saved в буфер до следующей отправки"""
+        category = event.get("category")
+        buffer = self._buffers.get(category)
+        if buffer is None:
+            buffer = self._buffers[category] = ProductsBuffer(category)
+        buffer.add(event)
+        if len(buffer.products) >= NATS_BATCH_SIZE * 10 and (self._early_flush is None or self._early_flush.done()):
+            # Не копим бесконечно, если парсер сохраняет быстрее интервала
+            self._early_flush = asyncio.create_task(self.flush())
+
+    async def sink(self, event: dict):
+        """Приемник шины событий: products_saved — в буфер, остальное — сразу"""
+        if event.get("type") == "products_saved":
+            self.add_products(event)
+        else:
+            await self.publish(NATS_UPDATES_SUBJECT, event)
+
+    async def flush(self):
+        """Отправляет все накопленные товары"""
+        buffers, self._buffers = self._buffers, {}
+        for buffer in buffers.values():
+            for message in buffer.to_messages(NATS_BATCH_SIZE):
+                await self.publish(NATS_UPDATES_SUBJECT, message)
+            print(f" Опубликовано в NATS: {buffer.counts['count']} товаров категории {buffer.category}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(NATS_FLUSH_INTERVAL)
+            if self._buffers:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f" Ошибка отправки товаров в NATS: {e}")
+
+    async def subscribe_updates(self, handler: MessageHandler, queue: str | None = None):
+        """Подписка на события товаров; handler получает событие и номер в потоке.
+
+        Без `queue` каждое событие получает каждый процесс. С `queue` процессы
+        с одинаковым именем образуют группу, и событие достается одному из
+        них; в JetStream это durable потребитель с именем группы, который
+        после перезапуска дочитывает пропущенное.
+        """
+        async def on_message(msg):
+            try:
+                data = json.loads(msg.data.decode())
+            except ValueError:
+                return
+            seq = msg.metadata.sequence.stream if self.js else None
+            await handler(data, seq)
+
+        if self.js and queue:
+            await self.js.subscribe(
+                NATS_UPDATES_SUBJECT, queue=queue, cb=on_message, deliver_policy=DeliverPolicy.NEW
+            )
+        elif self.js:
+            # Упорядоченный эфемерный потребитель только новых сообщений
+            await self.js.subscribe(
+                NATS_UPDATES_SUBJECT, cb=on_message, ordered_consumer=True, deliver_policy=DeliverPolicy.NEW
+            )
+        else:
+            await self.nc.subscribe(NATS_UPDATES_SUBJECT, queue=queue or "", cb=on_message)
+
+    async def publish_control(self, subject: str, data: dict):
+        """Служебное сообщение всем процессам мимо JetStream (не хранится в потоке)"""
+        if not self.connected:
+            return
+        try:
+            await self.nc.publish(subject, json.dumps(data, ensure_ascii=False).encode())
+        except Exception as e:
+            print(f" Ошибка публикации в NATS: {e}")
+
+    async def subscribe_control(self, subject: str, handler: Callable[[dict], Awaitable[None]]):
+        async def on_message(msg):
+            try:
+                data = json.loads(msg.data.decode())
+            except ValueError:
+                return
+            await handler(data)
+
+        await self.nc.subscribe(subject, cb=on_message)
+
+    async def replay(self, from_seq: int, limit: int = NATS_REPLAY_LIMIT) -> list[tuple[int, dict]]:
+        """События потока начиная с номера `from_seq` (не больше `limit`)"""
+        if not self.js:
+            return []
+        last_seq = (await self.js.stream_info(NATS_STREAM)).state.last_seq
+        if from_seq > last_seq:
+            return []
+
+        subscription = await self.js.subscribe(
+            NATS_UPDATES_SUBJECT,
+            ordered_consumer=True,
+            config=ConsumerConfig(deliver_policy=DeliverPolicy.BY_START_SEQUENCE, opt_start_seq=from_seq)
+        )
+        events = []
+        try:
+            while len(events) < limit:
+                msg = await subscription.next_msg(timeout=2)
+                seq = msg.metadata.sequence.stream
+                try:
+                    events.append((seq, json.loads(msg.data.decode())))
+                except ValueError:
+                    pass
+                if seq >= last_seq:
+                    break
+        except NatsTimeoutError:
+            pass
+        finally:
+            await subscription.unsubscribe()
+        return events
+
+    async def _ensure_jobs_stream(self):
+        config = StreamConfig(
+            name=NATS_JOBS_STREAM,
+            subjects=[NATS_JOBS_SUBJECT],
+            retention=RetentionPolicy.WORK_QUEUE,
+            duplicate_window=NATS_JOBS_DEDUPE_WINDOW
+        )
+        js = self.nc.jetstream()
+        try:
+            await js.add_stream(config)
+        except BadRequestError:
+            await js.update_stream(config)
+        return js
+
+    async def enqueue_job(self, job: dict, job_id: str) -> bool:
+        """Ставит задание в очередь воркеров.
+
+        `job_id` уходит в заголовок Nats-Msg-Id: JetStream отбрасывает
+        повтор с тем же id в течение NATS_JOBS_DEDUPE_WINDOW, поэтому
+        планировщики нескольких реплик не создают дубликатов. Возвращает
+        False, если задание уже было в очереди.
+        """
+        js = await self._ensure_jobs_stream()
+        ack = await js.publish(
+            NATS_JOBS_SUBJECT,
+            json.dumps(job, ensure_ascii=False).encode(),
+            headers={"Nats-Msg-Id": job_id}
+        )
+        return not ack.duplicate
+
+    async def jobs_subscription(self):
+        """Общий durable pull-потребитель заданий: каждое задание получает один воркер"""
+        js = await self._ensure_jobs_stream()
+        return await js.pull_subscribe(
+            NATS_JOBS_SUBJECT,
+            durable=NATS_JOBS_CONSUMER,
+            stream=NATS_JOBS_STREAM,
+            config=ConsumerConfig(
+                ack_policy=AckPolicy.EXPLICIT,
+                ack_wait=PARSER_JOB_ACK_WAIT,
+                max_deliver=PARSER_JOB_MAX_DELIVER
+            )
+        )
+
+
+nats_service = NatsService()
@@ -1,352 +1,662 @@
-from playwright.sync_api import sync_playwright
-import time
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 import asyncio
-import threading
 import json
-import re
+from typing import AsyncIterator
 from app.schemas import Product
-from app.models import ProductModel
 from app.database import engine
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.services.websocket_service import send_ws_notification
-from app.services.telegram_service import send_parser_notification
+from app.services.event_service import event_bus
+from app.services.browser_service import browser_pool
+from app.services.product_service import upsert_products, mark_delisted, normalize_link, ChangeSet, UPSERT_BATCH_SIZE
+from app.services.price_service import normalize_price
+from app.services.cache_service import response_cache
 import os
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 load_dotenv()
-import nats
-import asyncio
 
+DEFAULT_CATEGORY_URL = "https://www.ozon.ru/category/nastolnye-igry-13507/"
+PARSER_CONCURRENCY = int(os.getenv("PARSER_CONCURRENCY", "2"))
+PARSER_DOMAIN_DELAY = float(os.getenv("PARSER_DOMAIN_DELAY", "2.0"))  # секунд между переходами на один домен
+PARSER_EXTRACTION_MODE = os.getenv("PARSER_EXTRACTION_MODE", "evaluate")  # "evaluate" или "dom"
+PARSER_SCROLL_TIMEOUT = float(os.getenv("PARSER_SCROLL_TIMEOUT", "3.0"))  # ожидание новых карточек после скролла, сек
+PARSER_SCROLL_TIMEOUT_MAX = float(os.getenv("PARSER_SCROLL_TIMEOUT_MAX", "10.0"))
+PARSER_SCROLL_BACKOFF = float(os.getenv("PARSER_SCROLL_BACKOFF", "1.5"))  # множитель таймаута после пустого скролла
+PARSER_FAST_MODE = os.getenv("PARSER_FAST_MODE", "false").lower() in ("1", "true", "yes")  # блокировать тяжелые ресурсы
+PARSER_MAX_PRODUCTS = int(os.getenv("PARSER_MAX_PRODUCTS", "100"))  # товаров на категорию
+PARSER_QUEUE_SIZE = int(os.getenv("PARSER_QUEUE_SIZE", "10"))  # пачек в очереди между парсером и записью в БД
+PARSER_API_INTERCEPT = os.getenv("PARSER_API_INTERCEPT", "false").lower() in ("1", "true", "yes")  # читать товары из JSON API
 
-_nc = None
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+FIRST_PARTY_DOMAINS = ("ozon.ru", "ozone.ru")  # ozone.ru — статика и CDN Ozon
+API_URL_MARKERS = ("/api/entrypoint-api.bx/", "/api/composer-api.bx/")
 
-def set_nats_connection(nc):
-    """Установить NATS соединение для использования в парсере"""
-    global _nc
-    _nc = nc
+CARD_SELECTOR = '#contentScrollPaginator [class*="tile-root"]'
+CARD_FALLBACK_SELECTOR = 'a[href*="/product/"]'
+NAME_SELECTORS = [
+    'div.bq03_0_5-a span.tsBody500Medium',  # Точный селектор
+    'span.tsBody500Medium',
+    'div[class*="bq03_0_5-a"] span.tsBody500Medium',
+    'span.tsBody',
+    '[class*="tsBody"]',
+    '[class*="title"]',
+    'a span',
+    'div span'
+]
+PRICE_SELECTORS = [
+    'div.c35_3_11-a0 span.tsHeadline500Medium',  # Точный селектор
+    'span.tsHeadline500Medium',
+    'span[class*="price"]',
+    '[class*="tsHeadline"]',
+    '[class*="currency"]'
+]
+# Зачеркнутая цена до скидки
+OLD_PRICE_SELECTORS = [
+    'div.c35_3_11-a0 span.tsBodyControl400Small',
+    'span[class*="strikethrough"]',
+    's',
+    'del'
+]
 
-async def publish_to_nats(channel: str, data: dict):
-    """Публикация сообщения в NATS"""
-    global _nc
-    if _nc:
-        try:
-            message = json.dumps(data, ensure_ascii=False)
-            await _nc.publish(channel, message.encode())
-            print(f" Опубликовано в NATS канал '{channel}': {message[:100]}")
-        except Exception as e:
-            print(f" Ошибка публикации в NATS: {e}")
+# Те же цепочки селекторов, что и в режиме "dom", но выполняются в браузере
+# за один вызов: ссылка, название, цена и текст скидки для каждой карточки.
+# Разобранные карточки помечаются атрибутом data-parsed, поэтому каждый скролл
+# читает только новые плитки, а не всю страницу заново.
+EXTRACT_CARDS_JS = """
+({cardSelector, fallbackSelector, nameSelectors, priceSelectors, oldPriceSelectors}) => {
+    let cards = Array.from(document.querySelectorAll(cardSelector));
+    const fallback = cards.length === 0;
+    if (fallback) {
+        cards = Array.from(document.querySelectorAll(fallbackSelector));
+    }
+    const total = cards.length;
+    cards = cards.filter((card) => !card.hasAttribute('data-parsed'));
+    const text = (el) => (el && el.innerText ? el.innerText.trim() : '');
+    const firstText = (card, selectors, skip) => {
+        for (const selector of selectors) {
+            const el = card.querySelector(selector);
+            const value = text(el);
+            if (value && value !== skip) {
+                return value;
+            }
+        }
+        return '';
+    };
+    const result = [];
+    for (const card of cards) {
+        let linkEl = card.querySelector('a[data-prerender="true"]');
+        if (!linkEl) {
+            const href = card.getAttribute('href');
+            linkEl = href && href.includes('/product/') ? card : card.querySelector('a[href*="/product/"]');
+        }
+        const link = linkEl ? linkEl.getAttribute('href') : null;
+        if (!link) {
+            continue;
+        }
+        card.setAttribute('data-parsed', '1');
+        const discountContainer = card.querySelector('div.c35_3_11-a0');
+        const discountEl = discountContainer
+            ? discountContainer.querySelector('span.c35_3_11-b4')
+            : card.querySelector('span.c35_3_11-b4');
+        result.push({
+            link: link,
+            name: firstText(card, nameSelectors, 'Распродажа'),
+            price: firstText(card, priceSelectors, null),
+            old_price: firstText(card, oldPriceSelectors, null),
+            discount: text(discountEl)
+        });
+    }
+    return {total: total, fresh: cards.length, fallback: fallback, cards: result};
+}
+"""
 
-def publish_to_nats_sync(channel: str, data: dict):
-    """Синхронная обертка для публикации в NATS"""
-    if _nc:
-        try:
-            # Создаем новый event loop для публикации
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(publish_to_nats(channel, data))
-            finally:
-                loop.close()
-        except Exception as e:
-            print(f"❌ Ошибка синхронной публикации в NATS: {e}")
+# Условие для wait_for_function: на странице стало больше карточек, чем было.
+# Возвращает новое количество карточек (или false, пока роста нет).
+CARDS_GREW_JS = """
+({cardSelector, fallbackSelector, previous}) => {
+    const count = document.querySelectorAll(cardSelector).length
+        || document.querySelectorAll(fallbackSelector).length;
+    return count > previous ? count : false;
+}
+"""
+
+
+def notify_parser_status(status: str, message: str, category: str | None = None):
+    """Публикует статус парсера в шину событий (WebSocket, Telegram)"""
+    event_bus.publish({
+        "type": "parser_status",
+        "status": status,
+        "message": message,
+        "category": category
+    })
+
+def get_category_urls() -> list[str]:
+    """Список категорий для парсинга из OZON_CATEGORY_URLS (через запятую)"""
+    urls = [x.strip() for x in os.getenv("OZON_CATEGORY_URLS", "").split(",") if x.strip()]
+    return urls or [DEFAULT_CATEGORY_URL]
+
+
+class DomainRateLimiter:
+    """Разносит переходы на один домен минимум на `interval` секунд"""
+
+    def __init__(self, interval: float = PARSER_DOMAIN_DELAY):
+        self.interval = interval
+        self._next_slot: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, url: str):
+        host = urlparse(url).netloc
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+domain_limiter = DomainRateLimiter()
+
+
+def is_first_party(url: str) -> bool:
+    host = urlparse(url).hostname or ""
+    return any(host == domain or host.endswith("." + domain) for domain in FIRST_PARTY_DOMAINS)
+
+def _api_tile_to_card(item: dict) -> dict | None:
+    """Достает ссылку, название, цену и скидку из плитки tileGrid API Ozon"""
+    action = item.get("action")
+    link = action.get("link") if isinstance(action, dict) else None
+    if not isinstance(link, str) or '/product/' not in link:
+        return None
+    
+    name = ""
+    price = ""
+    old_price = ""
+    discount = ""
+    for state in item.get("mainState") or []:
+        atom = state.get("atom") if isinstance(state, dict) else None
+        if not isinstance(atom, dict):
+            continue
+        text_atom = atom.get("textAtom")
+        if isinstance(text_atom, dict) and not name:
+            name = (text_atom.get("text") or "").strip()
+        price_atom = atom.get("priceV2")
+        if isinstance(price_atom, dict):
+            prices = price_atom.get("price") or []
+            main = next((x for x in prices if x.get("textStyle") == "PRICE"), prices[0] if prices else None)
+            if main and not price:
+                price = (main.get("text") or "").strip()
+            original = next((x for x in prices if x.get("textStyle") == "ORIGINAL_PRICE"), None)
+            if original and not old_price:
+                old_price = (original.get("text") or "").strip()
+            discount = discount or (price_atom.get("discount") or "")
+    # Ключ товара строит _build_product через normalize_link, как и для DOM
+    return {"link": link, "name": name, "price": price, "old_price": old_price, "discount": discount}
+
+def extract_api_cards(payload) -> list[dict]:
+    """Ищет плитки товаров в JSON ответе страницы Ozon.
+
+    Состояния виджетов (widgetStates) приходят строками с вложенным JSON,
+    поэтому обходим структуру рекурсивно и раскрываем такие строки.
+    """
+    cards = []
+    stack = [payload]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            if node[:1] in ("{", "["):
+                try:
+                    stack.append(json.loads(node))
+                except ValueError:
+                    pass
+        elif isinstance(node, dict):
+            card = _api_tile_to_card(node) if "mainState" in node else None
+            if card:
+                cards.append(card)
+            else:
+                stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return cards
 
 
 class OzonParser:
-    def start(self, category_url: str):
+    """Парсер категорий Ozon на playwright.async_api.
+
+    Работает в event loop приложения, поэтому использует общее NATS
+    соединение и движок БД напрямую, без отдельных потоков и циклов.
+
+    `extraction_mode="evaluate"` снимает все карточки одним скриптом в
+    браузере за скролл; `"dom"` — прежний поэлементный обход через
+    ElementHandle, оставлен на случай расхождений в селекторах.
+
+    `fast_mode` блокирует картинки, медиа, шрифты и сторонние запросы, а
+    `intercept_api` берет товары прямо из JSON ответов, которые страница
+    запрашивает при скролле; DOM тогда читается только как запасной путь.
+    """
+
+    def __init__(
+        self,
+        extraction_mode: str = PARSER_EXTRACTION_MODE,
+        scroll_timeout: float = PARSER_SCROLL_TIMEOUT,
+        scroll_timeout_max: float = PARSER_SCROLL_TIMEOUT_MAX,
+        scroll_backoff: float = PARSER_SCROLL_BACKOFF,
+        fast_mode: bool = PARSER_FAST_MODE,
+        intercept_api: bool = PARSER_API_INTERCEPT
+    ):
+        self.extraction_mode = extraction_mode
+        self.scroll_timeout = scroll_timeout
+        self.scroll_timeout_max = scroll_timeout_max
+        self.scroll_backoff = scroll_backoff
+        self.fast_mode = fast_mode
+        self.intercept_api = intercept_api
+        self._api_cards: list[dict] = []  # Карточки из перехваченных JSON ответов
+        self._dom_processed = 0  # Сколько карточек уже обошли в режиме "dom"
+        self._cards_total = 0  # Сколько карточек было на странице при последнем обходе
+        # Прогресс текущего запуска, его читает реестр заданий (job_service)
+        self.scrolls = 0
+        self.found = 0
+        self.saved = 0
+        self.seen_links: set[str] = set()
+        self.exhausted = False  # скролл перестал давать товары раньше лимита (по таймауту, а не по признаку конца)
+
+    async def start(self, category_url: str):
         # Уведомление о запуске парсера
-        chat_ids_str = os.getenv("ALLOWED_USER_IDS", "")
-        TELEGRAM_CHAT_IDS = [int(x.strip()) for x in chat_ids_str.split(",") if x.strip()]
-        
-#        if TELEGRAM_CHAT_IDS:
-#            send_parser_notification(
-#                TELEGRAM_CHAT_IDS,
-#                "*Парсер запущен*\n\nНачинаю сбор данных с Ozon..."
-#            )
-
-        send_ws_notification(json.dumps({
-            "type": "parser_status",
-            "status": "started",
-            "message": "Парсер запущен, начинаю сбор данных..."
-        }, ensure_ascii=False))
+        notify_parser_status("started", "Парсер запущен, начинаю сбор данных...", category_url)
         
-        with sync_playwright() as p:
-            browser = p.chromium.launch(
-                headless=False,
-                args=['--disable-blink-features=AutomationControlled']
-            )
-            context = browser.new_context(
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                locale='ru-RU',
-                extra_http_headers={'Accept-Language': 'ru-RU,ru;q=0.9'}
-            )
-            self.page = context.new_page()
-            self.page.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-            
-            print(f"Открываю страницу: {category_url}")
-            self.page.goto(category_url)
-            time.sleep(2)  # Увеличено время ожидания
-            
-            # Уведомление о начале парсинга
-            send_ws_notification(json.dumps({
-                "type": "parser_status",
-                "status": "parsing",
-                "message": "Начинаю парсинг товаров..."
-            }, ensure_ascii=False))
-            
-            # Парсим товары
-            products = self.parce_products()
-            print(f"Найдено товаров: {len(products)}")
-            
-            # Уведомление о завершении парсинга
-            send_ws_notification(json.dumps({
-                "type": "parser_status",
-                "status": "parsed",
-                "message": f"Парсинг завершен! Найдено товаров: {len(products)}"
-            }, ensure_ascii=False))
+        # Товары сохраняются пачками по мере скролла: парсер кладет их в
+        # ограниченную очередь, а отдельная задача пишет в БД и рассылает
+        # обновления. Заполненная очередь притормаживает скролл.
+        queue: asyncio.Queue[list[Product] | None] = asyncio.Queue(maxsize=PARSER_QUEUE_SIZE)
+        consumer = asyncio.create_task(self._consume_batches(queue, category_url))
+        found = 0
+        try:
+            # Страница берется из пула прогретых контекстов браузера
+            async with browser_pool.page() as page:
+                self.page = page
+                await self._attach_network_hooks()
+                try:
+                    await domain_limiter.wait(category_url)
+                    print(f"Открываю страницу: {category_url}")
+                    # Готовность страницы дальше определяется по #contentScrollPaginator
+                    await self.page.goto(category_url, wait_until="domcontentloaded")
+                    
+                    # Уведомление о начале парсинга
+                    notify_parser_status("parsing", "Начинаю парсинг товаров...", category_url)
+                    
+                    # Парсим товары
+                    async for batch in self.iter_product_batches():
+                        found += len(batch)
+                        await queue.put(batch)
+                    print(f"Найдено товаров: {found}")
+                finally:
+                    # Страница вернется в пул — снимаем перехватчики
+                    await self._detach_network_hooks()
+        finally:
+            await queue.put(None)
+            saved = await consumer
             
-            # Сохраняем в БД
-            if products:
-                send_ws_notification(json.dumps({
-                    "type": "parser_status",
-                    "status": "saving",
-                    "message": "Сохраняю товары в базу данных..."
-                }, ensure_ascii=False))
-                self.save_products_to_db(products)
-                
-                # Уведомление об успешном сохранении
-                send_ws_notification(json.dumps({
-                    "type": "parser_status",
-                    "status": "completed",
-                    "message": f"Готово! Сохранено товаров: {len(products)}"
-                }, ensure_ascii=False))
-
-#                if TELEGRAM_CHAT_IDS:
-#                    send_parser_notification(
-#                        TELEGRAM_CHAT_IDS,
-#                        f"✅ *Парсинг завершен*\n\n"
-#                        f"📦 Найдено товаров: {len(products)}\n"
-#                        f"💾 Сохранено в базу данных"
-#                    )
-            else:
-                if TELEGRAM_CHAT_IDS:
-                    send_parser_notification(
-                        TELEGRAM_CHAT_IDS,
-                        "⚠️ *Парсинг завершен*\n\nТовары не найдены"
-                    )
-
-                send_ws_notification(json.dumps({
-                    "type": "parser_status",
-                    "status": "error",
-                    "message": "Товары не найдены"
-                }, ensure_ascii=False))
+        # Уведомление о завершении парсинга
+        notify_parser_status("parsed", f"Парсинг завершен! Найдено товаров: {found}", category_url)
+        
+        if found and self.exhausted:
+            # Обход не оборван лимитом — учитываем его; снятыми товары станут
+            # только после DELIST_AFTER_CRAWLS таких обходов подряд
+            await self._mark_delisted(category_url)
+        
+        if found and saved:
+            # Уведомление об успешном сохранении
+            notify_parser_status("completed", f"Готово! Сохранено товаров: {saved} из {found}", category_url)
+        elif found:
+            message = f"Не удалось сохранить товары: найдено {found}, сохранено 0"
+            notify_parser_status("error", message, category_url)
+            # Воркер по исключению вернет задание в очередь, реестр пометит его failed
+            raise RuntimeError(message)
+        else:
+            # Статус error дополнительно уходит в Telegram, см. telegram_service
+            notify_parser_status("error", "Товары не найдены", category_url)
+
+    async def _consume_batches(self, queue: asyncio.Queue, category_url: str) -> int:
+        """Сохраняет пачки товаров из очереди, пока не придет None"""
+        saved = 0
+        notified = False
+        finished = False
+        while not finished:
+            batch = await queue.get()
+            if batch is None:
+                break
+            # Если БД не успевает за парсером, склеиваем накопившиеся пачки в одну запись
+            while len(batch) < UPSERT_BATCH_SIZE and not queue.empty():
+                more = queue.get_nowait()
+                if more is None:
+                    finished = True
+                    break
+                batch.extend(more)
+            if not notified:
+                notify_parser_status("saving", "Сохраняю товары в базу данных...", category_url)
+                notified = True
+            try:
+                await self._save_products_async(batch, category_url)
+            except Exception as e:
+                # Очередь должна разбираться до конца, иначе парсер встанет на put();
+                # откатившаяся пачка в счетчик сохраненных не попадает
+                print(f"Ошибка при сохранении пачки товаров: {e}")
+                continue
+            saved += len(batch)
+            self.saved = saved
+        return saved
     
-    def parce_products(self, max_products: int = 100) -> list[Product]:
-        products = []
-        seen_links = set()
+    async def iter_product_batches(self, max_products: int = PARSER_MAX_PRODUCTS) -> AsyncIterator[list[Product]]:
+        """Отдает новые товары пачкой после каждого скролла"""
+        seen_links = self.seen_links = set()
+        self.exhausted = False
+        total = 0
         
         try:
-            self.page.wait_for_selector('#contentScrollPaginator', timeout=10000)
+            await self.page.wait_for_selector('#contentScrollPaginator', timeout=10000)
         except:
-            return products
+            return
         
+        self._dom_processed = 0
+        self._cards_total = 0
+        # Контейнер уже есть, ждем первые отрисованные карточки
+        await self._wait_for_new_cards(self.scroll_timeout_max)
+        timeout = self.scroll_timeout
         scroll_num = 0
         no_new_count = 0
         
-        while len(products) < max_products:
+        while total < max_products:
             scroll_num += 1
             
-            # Проверяем, сколько карточек найдено
-            cards = self.page.query_selector_all('#contentScrollPaginator [class*="tile-root"]')
-            print(f"Найдено карточек на странице: {len(cards)}")
+            # Сначала товары из перехваченных ответов API, DOM — запасной путь
+            raw_cards, self._api_cards = self._api_cards, []
+            if not raw_cards:
+                if self.extraction_mode == "evaluate":
+                    raw_cards = await self._extract_cards_evaluate()
+                else:
+                    raw_cards = await self._extract_cards_dom(seen_links)
             
-            if len(cards) == 0:
-                # Пробуем альтернативные селекторы
-                cards = self.page.query_selector_all('a[href*="/product/"]')
-                print(f"Альтернативный поиск по ссылкам: {len(cards)}")
-            
-            new_count = 0
-            for card in cards:
-                try:
-                    # Пробуем разные варианты поиска ссылки
-                    link_elem = card.query_selector('a[data-prerender="true"]')
-                    if not link_elem:
-                        # Если карточка уже является ссылкой (проверяем через href)
-                        try:
-                            href = card.get_attribute('href')
-                            if href and '/product/' in href:
-                                link_elem = card
-                            else:
-                                link_elem = card.query_selector('a[href*="/product/"]')
-                        except:
-                            link_elem = card.query_selector('a[href*="/product/"]')
-                    
-                    if not link_elem:
-                        continue
-                    
-                    link = link_elem.get_attribute('href')
-                    if not link:
-                        continue
-                    
-                    # Обрабатываем относительные ссылки
-                    if link.startswith('/product/'):
-                        link = 'https://www.ozon.ru' + link
-                    
-                    if link in seen_links or not '/product/' in link:
-                        continue
-                    
-                    seen_links.add(link)
-                    
-                    # Название - пробуем разные селекторы
-                    name = ""
-                    name_selectors = [
-                        'div.bq03_0_5-a span.tsBody500Medium',  # Точный селектор
-                        'span.tsBody500Medium',
-                        'div[class*="bq03_0_5-a"] span.tsBody500Medium',
-                        'span.tsBody',
-                        '[class*="tsBody"]',
-                        '[class*="title"]',
-                        'a span',
-                        'div span'
-                    ]
-                    for selector in name_selectors:
-                        name_elem = card.query_selector(selector)
-                        if name_elem:
-                            name_text = name_elem.inner_text().strip()
-                            if name_text and name_text != "Распродажа":
-                                name = name_text
-                                break
-                    
-                    # Цена - пробуем разные селекторы
-                    price = ""
-                    price_selectors = [
-                        'div.c35_3_11-a0 span.tsHeadline500Medium',  # Точный селектор
-                        'span.tsHeadline500Medium',
-                        'span[class*="price"]',
-                        '[class*="tsHeadline"]',
-                        '[class*="currency"]'
-                    ]
-                    for selector in price_selectors:
-                        price_elem = card.query_selector(selector)
-                        if price_elem:
-                            price_text = price_elem.inner_text().strip()
-                            if price_text:
-                                price = price_text
-                                break
-                    
-                    # Скидка - div.c35_3_11-a0 span.c35_3_11-b4
-                    discount = 0.0
-                    try:
-                        discount_container = card.query_selector('div.c35_3_11-a0')
-                        if discount_container:
-                            discount_elem = discount_container.query_selector('span.c35_3_11-b4')
-                            if discount_elem:
-                                discount_text = discount_elem.inner_text().strip()
-                                discount_match = re.search(r'(\d+)', discount_text.replace('−', '-').replace('–', '-'))
-                                if discount_match:
-                                    discount = float(discount_match.group(1))
-                        else:
-                            # Альтернативный поиск скидки
-                            discount_elem = card.query_selector('span.c35_3_11-b4')
-                            if discount_elem:
-                                discount_text = discount_elem.inner_text().strip()
-                                discount_match = re.search(r'(\d+)', discount_text.replace('−', '-').replace('–', '-'))
-                                if discount_match:
-                                    discount = float(discount_match.group(1))
-                    except:
-                        pass
-                    
-                    if link:  # Добавляем даже без названия для отладки
-                        products.append(Product(
-                            name=name or "Без названия", 
-                            price=price or "Нет цены", 
-                            link=link,
-                            discount=discount
-                        ))
-                        new_count += 1
-                        if len(products) >= max_products:
-                            break
-                except Exception as e:
-                    print(f"Ошибка при парсинге карточки: {e}")
+            batch = []
+            for raw in raw_cards:
+                product = self._build_product(raw, seen_links)
+                if not product:
                     continue
+                batch.append(product)
+                if total + len(batch) >= max_products:
+                    break
+            total += len(batch)
+            self.scrolls, self.found = scroll_num, total
             
-            print(f"Скролл {scroll_num}: найдено новых товаров: {new_count}, всего: {len(products)}")
+            print(f"Скролл {scroll_num}: найдено новых товаров: {len(batch)}, всего: {total}")
             
-            if new_count == 0:
+            if batch:
+                no_new_count = 0
+                yield batch
+            else:
                 no_new_count += 1
                 if no_new_count >= 3:
                     print("Прекращено: нет новых товаров")
+                    self.exhausted = True
                     break
-            else:
-                no_new_count = 0
             
-            if len(products) >= max_products:
+            if total >= max_products:
                 break
             
-            self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            time.sleep(2)
-        
-        return products
+            await self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+            if await self._wait_for_new_cards(timeout):
+                timeout = self.scroll_timeout
+            else:
+                # Контент не подгрузился — в следующий раз ждем дольше
+                timeout = min(timeout * self.scroll_backoff, self.scroll_timeout_max)
 
-    async def _save_products_async(self, products: list[Product]):
-        """Асинхронное сохранение продуктов в БД"""
-        async with AsyncSession(engine) as session:
+    async def _attach_network_hooks(self):
+        self._api_cards = []
+        if self.fast_mode:
+            await self.page.route("**/*", self._route_request)
+        if self.intercept_api:
+            self.page.on("response", self._on_response)
+
+    async def _detach_network_hooks(self):
+        try:
+            if self.fast_mode:
+                await self.page.unroute("**/*", self._route_request)
+            if self.intercept_api:
+                self.page.remove_listener("response", self._on_response)
+        except Exception as e:
+            print(f"Ошибка при снятии перехватчиков страницы: {e}")
+
+    async def _route_request(self, route):
+        """Быстрый режим: не грузим картинки, медиа, шрифты и сторонние ресурсы"""
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        elif request.resource_type != "document" and not is_first_party(request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _on_response(self, response):
+        """Собирает товары из JSON ответов, которые страница запрашивает при скролле"""
+        if not any(marker in response.url for marker in API_URL_MARKERS):
+            return
+        try:
+            payload = await response.json()
+        except Exception:
+            return
+        cards = extract_api_cards(payload)
+        if cards:
+            print(f"Из ответа API получено карточек: {len(cards)}")
+            self._api_cards.extend(cards)
+
+    async def _extract_cards_evaluate(self) -> list[dict]:
+        """Снимает данные всех карточек одним page.evaluate"""
+        result = await self.page.evaluate(EXTRACT_CARDS_JS, {
+            "cardSelector": CARD_SELECTOR,
+            "fallbackSelector": CARD_FALLBACK_SELECTOR,
+            "nameSelectors": NAME_SELECTORS,
+            "priceSelectors": PRICE_SELECTORS,
+            "oldPriceSelectors": OLD_PRICE_SELECTORS
+        })
+        if result["fallback"]:
+            print(f"Альтернативный поиск по ссылкам: {result['total']}, новых: {result['fresh']}")
+        else:
+            print(f"Найдено карточек на странице: {result['total']}, новых: {result['fresh']}")
+        self._cards_total = result["total"]
+        return result["cards"]
+
+    async def _extract_cards_dom(self, seen_links: set[str]) -> list[dict]:
+        """Поэлементное извлечение карточек через ElementHandle (режим "dom")"""
+        cards = await self.page.query_selector_all(CARD_SELECTOR)
+        print(f"Найдено карточек на странице: {len(cards)}")
+        
+        if len(cards) == 0:
+            # Пробуем альтернативные селекторы
+            cards = await self.page.query_selector_all(CARD_FALLBACK_SELECTOR)
+            print(f"Альтернативный поиск по ссылкам: {len(cards)}")
+        
+        # Новые карточки дописываются в конец — обходим только их.
+        # Если список стал короче (страница перерисовалась), начинаем сначала.
+        if len(cards) < self._dom_processed:
+            self._dom_processed = 0
+        fresh_cards = cards[self._dom_processed:]
+        self._dom_processed = len(cards)
+        self._cards_total = len(cards)
+        
+        raw_cards = []
+        for card in fresh_cards:
             try:
-                saved_products = []
-                for product in products:
-                    db_product = ProductModel(
-                        name=product.name,
-                        price=product.price,
-                        link=product.link,
-                        discount=product.discount
-                    )
-                    session.add(db_product)
-                    saved_products.append({
-                        "id": None,  # Будет установлен после commit
-                        "name": product.name,
-                        "price": product.price,
-                        "link": product.link,
-                        "discount": product.discount
-                    })
+                # Пробуем разные варианты поиска ссылки
+                link_elem = await card.query_selector('a[data-prerender="true"]')
+                if not link_elem:
+                    # Если карточка уже является ссылкой (проверяем через href)
+                    try:
+                        href = await card.get_attribute('href')
+                        if href and '/product/' in href:
+                            link_elem = card
+                        else:
+                            link_elem = await card.query_selector('a[href*="/product/"]')
+                    except:
+                        link_elem = await card.query_selector('a[href*="/product/"]')
                 
-                await session.commit()
+                if not link_elem:
+                    continue
                 
-                # Обновляем ID после сохранения
-                for i, db_product in enumerate(saved_products):
-                    # Получаем ID из сессии (после flush)
-                    pass
+                link = await link_elem.get_attribute('href')
+                # Уже разобранные карточки не читаем повторно
+                if not link or normalize_link(link) in seen_links:
+                    continue
                 
-                print(f"Сохранено {len(products)} товаров в БД")
+                # Название - пробуем разные селекторы
+                name = ""
+                for selector in NAME_SELECTORS:
+                    name_elem = await card.query_selector(selector)
+                    if name_elem:
+                        name_text = (await name_elem.inner_text()).strip()
+                        if name_text and name_text != "Распродажа":
+                            name = name_text
+                            break
                 
-                # Публикуем в NATS о сохранении товаров
-                await publish_to_nats("products.updates", {
-                    "type": "products_saved",
-                    "count": len(products),
-                    "message": f"Сохранено {len(products)} товаров в БД",
-                    "products": saved_products[:10]
+                # Цена - пробуем разные селекторы
+                price = ""
+                for selector in PRICE_SELECTORS:
+                    price_elem = await card.query_selector(selector)
+                    if price_elem:
+                        price_text = (await price_elem.inner_text()).strip()
+                        if price_text:
+                            price = price_text
+                            break
+                
+                old_price = ""
+                for selector in OLD_PRICE_SELECTORS:
+                    old_price_elem = await card.query_selector(selector)
+                    if old_price_elem:
+                        old_price_text = (await old_price_elem.inner_text()).strip()
+                        if old_price_text:
+                            old_price = old_price_text
+                            break
+                
+                # Скидка - div.c35_3_11-a0 span.c35_3_11-b4
+                discount = ""
+                try:
+                    discount_container = await card.query_selector('div.c35_3_11-a0')
+                    if discount_container:
+                        discount_elem = await discount_container.query_selector('span.c35_3_11-b4')
+                    else:
+                        # Альтернативный поиск скидки
+                        discount_elem = await card.query_selector('span.c35_3_11-b4')
+                    if discount_elem:
+                        discount = (await discount_elem.inner_text()).strip()
+                except:
+                    pass
+                
+                raw_cards.append({
+                    "link": link, "name": name, "price": price, "old_price": old_price, "discount": discount
                 })
+            except Exception as e:
+                print(f"Ошибка при парсинге карточки: {e}")
+                continue
+        return raw_cards
+
+    async def _wait_for_new_cards(self, timeout: float) -> bool:
+        """Ждет появления новых карточек после скролла вместо фиксированной паузы"""
+        try:
+            handle = await self.page.wait_for_function(CARDS_GREW_JS, arg={
+                "cardSelector": CARD_SELECTOR,
+                "fallbackSelector": CARD_FALLBACK_SELECTOR,
+                "previous": self._cards_total
+            }, polling=100, timeout=timeout * 1000)
+            self._cards_total = await handle.json_value()
+            return True
+        except PlaywrightTimeoutError:
+            print(f"Новые карточки не появились за {timeout:.1f} сек")
+            return False
+
+    def _build_product(self, raw: dict, seen_links: set[str]) -> Product | None:
+        """Превращает сырые данные карточки в Product, отбрасывая дубликаты"""
+        link = raw.get("link")
+        if not link:
+            return None
+        
+        link = normalize_link(link)
+        if link in seen_links or not '/product/' in link:
+            return None
+        
+        seen_links.add(link)
+        
+        # Нормализация: числовая цена, старая цена, валюта и скидка
+        prices = normalize_price(raw.get("price"), raw.get("old_price"), raw.get("discount"))
+        
+        # Добавляем даже без названия для отладки
+        return Product(
+            name=raw.get("name") or "Без названия",
+            price=raw.get("price") or "Нет цены",
+            link=link,
+            **prices
+        )
+
+    async def _save_products_async(self, products: list[Product], category: str | None = None):
+        """Асинхронное сохранение продуктов в БД через bulk upsert.
+
+        Ошибка записи откатывает транзакцию, публикуется событием error и
+        пробрасывается дальше, чтобы вызывающий не посчитал пачку сохраненной.
+        """
+        async with AsyncSession(engine) as session:
+            try:
+                changes = await upsert_products(session, products, category)
+                await session.commit()
+                counts = changes.counts
+                
+                message = (
+                    f"Сохранено {len(products)} товаров в БД: новых {counts['inserted']}, "
+                    f"обновлено {counts['updated']}, без изменений {counts['unchanged']}"
+                )
+                print(message)
+                if not changes.changed:
+                    return
+                
+                # Ответы read-эндпоинтов этого процесса устарели
+                response_cache.bump()
+                self._publish_changes(changes, category, len(products), message)
                 
             except Exception as e:
                 await session.rollback()
                 print(f"Ошибка при сохранении в БД: {e}")
                 # Публикуем ошибку в NATS
-                await publish_to_nats("products.updates", {
+                event_bus.publish({
                     "type": "error",
                     "message": f"Ошибка при сохранении в БД: {str(e)}"
                 })
+                raise
     
-    def save_products_to_db(self, products: list[Product]):
-        """Синхронная обертка для сохранения в БД"""
-        def run_async():
-            """Запускаем асинхронную функцию в отдельном потоке"""
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
+    def _publish_changes(self, changes: ChangeSet, category: str | None, count: int, message: str):
+        """Рассылает только изменения: products_saved с новыми и обновленными
+        товарами (nats_service схлопывает их и режет на сообщения по
+        NATS_BATCH_SIZE) и события new_product, price_drop, removed.
+        """
+        if changes.inserted or changes.updated:
+            event_bus.publish({
+                "type": "products_saved",
+                "category": category,
+                "count": count,
+                **changes.counts,
+                "message": message,
+                "products": changes.inserted + changes.updated
+            })
+        for event in changes.events(category):
+            event_bus.publish(event)
+
+    async def _mark_delisted(self, category_url: str):
+        """Учитывает полный обход категории, см. product_service.mark_delisted"""
+        async with AsyncSession(engine) as session:
             try:
-                new_loop.run_until_complete(self._save_products_async(products))
-            finally:
-                new_loop.close()
-        
-        try:
-            thread = threading.Thread(target=run_async)
-            thread.start()
-            thread.join()
-        except Exception as e:
-            print(f"Ошибка при запуске сохранения в БД: {e}")
\ No newline at end of file
+                changes = await mark_delisted(session, category_url, self.seen_links)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                print(f"Ошибка при поиске снятых товаров: {e}")
+                return
+        if changes.removed:
+            print(f"Сняты с продажи: {len(changes.removed)} товаров")
+            response_cache.bump()
+            for event in changes.events(category_url):
+                event_bus.publish(event)
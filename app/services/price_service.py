@@ -0,0 +1,83 @@
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+import re
+from app.models import PriceHistoryModel
+
+PRICE_NUMBER_RE = re.compile(r'\d+(?:[.,]\d{1,2})?')
+PRICE_SPACES_RE = re.compile(r'\s')  # в т.ч. неразрывные и узкие пробелы Ozon
+DISCOUNT_RE = re.compile(r'(\d+)')
+
+# Знак валюты в тексте цены -> код ISO 4217
+CURRENCY_SIGNS = {
+    "₽": "RUB",
+    "руб": "RUB",
+    "$": "USD",
+    "€": "EUR",
+    "₸": "KZT",
+    "Br": "BYN",
+}
+DEFAULT_CURRENCY = "RUB"
+
+
+def parse_price_kopecks(price_text: str | None) -> int | None:
+    """Переводит цену вида "1 299 ₽" или "1 299,50 ₽" в копейки; None если цены нет"""
+    if not price_text:
+        return None
+    match = PRICE_NUMBER_RE.search(PRICE_SPACES_RE.sub('', price_text))
+    if not match:
+        return None
+    rubles, _, fraction = match.group(0).replace(',', '.').partition('.')
+    return int(rubles) * 100 + int(fraction.ljust(2, '0') or 0)
+
+def parse_currency(price_text: str | None) -> str | None:
+    """Код валюты по знаку в тексте цены; для цены без знака — рубли"""
+    if parse_price_kopecks(price_text) is None:
+        return None
+    for sign, code in CURRENCY_SIGNS.items():
+        if sign in price_text:
+            return code
+    return DEFAULT_CURRENCY
+
+def parse_discount(discount_text: str | None) -> float | None:
+    """Скидка из текста вида "−35%"; None если в тексте ее нет"""
+    match = DISCOUNT_RE.search(discount_text or "")
+    return float(match.group(1)) if match else None
+
+def normalize_price(price_text: str | None, old_price_text: str | None = None,
+                    discount_text: str | None = None) -> dict:
+    """Разбирает тексты карточки в числовые поля товара.
+
+    Возвращает price_kopecks, old_price_kopecks, currency и discount. Если
+    Ozon не показал процент скидки, а зачеркнутая цена есть, скидка
+    считается по двум ценам.
+    """
+    price_kopecks = parse_price_kopecks(price_text)
+    old_price_kopecks = parse_price_kopecks(old_price_text)
+    if old_price_kopecks is not None and (price_kopecks is None or old_price_kopecks <= price_kopecks):
+        old_price_kopecks = None
+    
+    discount = parse_discount(discount_text)
+    if discount is None and old_price_kopecks:
+        discount = float(round((old_price_kopecks - price_kopecks) * 100 / old_price_kopecks))
+    return {
+        "price_kopecks": price_kopecks,
+        "old_price_kopecks": old_price_kopecks,
+        "currency": parse_currency(price_text),
+        "discount": discount or 0.0,
+    }
+
+async def record_price_history(session: AsyncSession, entries: list[dict]):
+    """Пишет точки истории цен одним executemany.
+
+    `entries` — словари с product_id, price_kopecks и discount. Вызывающий
+    передает только товары, у которых цена или скидка действительно
+    изменились, поэтому в таблице хранятся одни дельты.
+    """
+    if not entries:
+        return
+    now = datetime.now()
+    await session.execute(
+        insert(PriceHistoryModel.__table__),
+        [{**entry, "recorded_at": now} for entry in entries]
+    )
@@ -0,0 +1,285 @@
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+import hashlib
+import os
+from app.models import ProductModel
+from app.schemas import Product
+from app.services.price_service import parse_price_kopecks, parse_currency, record_price_history
+from app.services.stats_service import StatsDelta, apply_stats_delta
+
+UPSERT_BATCH_SIZE = 500
+PG_COPY_THRESHOLD = int(os.getenv("PG_COPY_THRESHOLD", "200"))  # с какого размера пачки PostgreSQL пишет через COPY
+DELIST_AFTER_CRAWLS = int(os.getenv("DELIST_AFTER_CRAWLS", "3"))  # полных обходов подряд без товара, после которых он снят
+
+# Поля, изменение которых считается обновлением товара
+TRACKED_FIELDS = ("name", "price", "price_kopecks", "old_price_kopecks", "currency", "discount")
+# Что еще переписывается при вставке или обновлении товара
+UPDATED_FIELDS = TRACKED_FIELDS + ("content_hash", "category", "delisted_at", "missed_crawls")
+
+
+class ChangeSet:
+    """Результат сравнения спарсенных товаров с сохраненными"""
+
+    def __init__(self):
+        self.inserted: list[dict] = []
+        self.updated: list[dict] = []
+        self.price_drops: list[dict] = []
+        self.removed: list[dict] = []
+        self.unchanged = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated or self.removed)
+
+    @property
+    def counts(self) -> dict:
+        return {
+            "inserted": len(self.inserted),
+            "updated": len(self.updated),
+            "unchanged": self.unchanged,
+            "removed": len(self.removed)
+        }
+
+    def events(self, category: str | None = None) -> list[dict]:
+        """События new_product, price_drop и removed — по одному на тип"""
+        events = []
+        for event_type, products in (
+            ("new_product", self.inserted),
+            ("price_drop", self.price_drops),
+            ("removed", self.removed),
+        ):
+            if products:
+                events.append({"type": event_type, "category": category, "count": len(products), "products": products})
+        return events
+
+
+def content_hash(product: Product) -> str:
+    """Хэш отслеживаемых полей товара"""
+    raw = "\x1f".join(str(getattr(product, field)) for field in TRACKED_FIELDS)
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+def product_payload(product: Product) -> dict:
+    """Товар для событий NATS/WebSocket"""
+    return {
+        "name": product.name,
+        "price": product.price,
+        "price_kopecks": product.price_kopecks,
+        "old_price_kopecks": product.old_price_kopecks,
+        "link": product.link,
+        "discount": product.discount
+    }
+
+
+def normalize_link(link: str) -> str:
+    """Ключ товара: абсолютная ссылка без параметров и якоря.
+
+    Ozon добавляет к ссылкам выдачи ?at=<токен>, который меняется между
+    сессиями, — с ним один и тот же товар каждый запуск получал бы новую
+    строку. Парсер (DOM и перехват API), upsert и миграция в init_db берут
+    ключ только отсюда.
+    """
+    link = link.strip().split("#", 1)[0].split("?", 1)[0]
+    if link.startswith('/product/'):
+        return 'https://www.ozon.ru' + link
+    return link
+
+def _prepare(product: Product) -> Product:
+    """Товар с нормализованной ссылкой и числовыми полями цены (если их не разобрал парсер)"""
+    update = {}
+    link = normalize_link(product.link)
+    if link != product.link:
+        update["link"] = link
+    if product.price_kopecks is None and product.currency is None:
+        update["price_kopecks"] = parse_price_kopecks(product.price)
+        update["currency"] = parse_currency(product.price)
+    return product.model_copy(update=update) if update else product
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def _upsert_rows(session: AsyncSession, rows: list[dict]):
+    """INSERT ... ON CONFLICT(link) DO UPDATE в диалекте текущей БД"""
+    table = ProductModel.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql" and len(rows) >= PG_COPY_THRESHOLD:
+        await _copy_upsert_rows(session, rows)
+        return
+    
+    insert_stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table)
+    upsert_stmt = insert_stmt.on_conflict_do_update(
+        index_elements=[table.c.link],
+        set_={field: insert_stmt.excluded[field] for field in UPDATED_FIELDS}
+    )
+    await session.execute(upsert_stmt, rows)
+
+async def _copy_upsert_rows(session: AsyncSession, rows: list[dict]):
+    """PostgreSQL: COPY пачки во временную таблицу и один INSERT ... SELECT с ON CONFLICT"""
+    columns = list(rows[0])
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    updates = ", ".join(f'"{field}" = EXCLUDED."{field}"' for field in UPDATED_FIELDS)
+    
+    connection = await session.connection()
+    await connection.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS products_ingest "
+        "(LIKE products INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    ))
+    await connection.execute(text("TRUNCATE products_ingest"))
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "products_ingest",
+        records=[tuple(row[column] for column in columns) for row in rows],
+        columns=columns
+    )
+    await connection.execute(text(
+        f"INSERT INTO products ({column_list}) SELECT {column_list} FROM products_ingest "
+        f"ON CONFLICT (link) DO UPDATE SET {updates}"
+    ))
+
+async def upsert_products(session: AsyncSession, products: list[Product], category: str | None = None) -> ChangeSet:
+    """Вставляет новые и обновляет изменившиеся товары по ключу link.
+
+    Текущее состояние (хэш содержимого, цена, скидка) читается пачкой на
+    каждый батч, поэтому в БД уходят только новые и изменившиеся строки —
+    одним executemany с INSERT ... ON CONFLICT(link) DO UPDATE (в PostgreSQL
+    крупные пачки идут через COPY). Коммит остается за вызывающим.
+    Для новых товаров и товаров с изменившейся ценой или скидкой в той же
+    транзакции пишется точка истории цен и обновляется сводная статистика.
+    Снятый с продажи товар, который снова появился, считается обновленным.
+    """
+    # Дубликаты ссылок внутри одного прогона схлопываем, последний выигрывает
+    prepared = [_prepare(product) for product in products]
+    unique = list({product.link: product for product in prepared}.values())
+    changes = ChangeSet()
+    stats_delta = StatsDelta()
+    
+    for batch in _chunks(unique, UPSERT_BATCH_SIZE):
+        stmt = select(
+            ProductModel.link, ProductModel.content_hash, ProductModel.price_kopecks,
+            ProductModel.discount, ProductModel.delisted_at, ProductModel.category
+        ).where(ProductModel.link.in_([product.link for product in batch]))
+        existing = {row.link: row for row in (await session.execute(stmt)).all()}
+        
+        rows = []
+        price_changes = {}
+        moved = []  # неизменившиеся товары, найденные в другой категории
+        now = datetime.now()
+        for product in batch:
+            current = existing.get(product.link)
+            price_kopecks = product.price_kopecks
+            product_hash = content_hash(product)
+            if current is None:
+                changes.inserted.append(product_payload(product))
+                price_changes[product.link] = {"price_kopecks": price_kopecks, "discount": product.discount}
+                stats_delta.add(product.discount, price_kopecks)
+            elif current.content_hash != product_hash or current.delisted_at is not None:
+                current_kopecks = current.price_kopecks
+                payload = product_payload(product)
+                if current.delisted_at is None:
+                    # Прежние цена и скидка: по ним правила отслеживания отличают
+                    # падение цены и рост скидки от прочих изменений. Вернувшийся
+                    # в продажу товар их не получает и считается новым
+                    payload.update(previous_price_kopecks=current_kopecks, previous_discount=current.discount)
+                changes.updated.append(payload)
+                if price_kopecks != current_kopecks or product.discount != current.discount:
+                    price_changes[product.link] = {"price_kopecks": price_kopecks, "discount": product.discount}
+                if price_kopecks is not None and current_kopecks is not None and price_kopecks < current_kopecks:
+                    changes.price_drops.append({**product_payload(product), "previous_price_kopecks": current_kopecks})
+                if current.delisted_at is not None:
+                    # Снятый товар вычтен из сводки в mark_delisted — возвращаем его
+                    stats_delta.add(product.discount, price_kopecks)
+                else:
+                    stats_delta.replace(current.discount, current_kopecks, product.discount, price_kopecks)
+            else:
+                changes.unchanged += 1
+                if category is not None and current.category != category:
+                    moved.append(product.link)
+                continue
+            stats_delta.last_product = {"name": product.name, "price": product.price, "link": product.link}
+            rows.append({
+                "link": product.link,
+                **{field: getattr(product, field) for field in TRACKED_FIELDS},
+                "content_hash": product_hash,
+                "category": category,
+                "delisted_at": None,
+                "missed_crawls": 0,
+                "created_at": now
+            })
+        
+        if moved:
+            # Категория не входит в хэш, но по ней mark_delisted ищет пропавшие товары
+            await session.execute(
+                update(ProductModel).where(ProductModel.link.in_(moved)).values(category=category)
+            )
+        if not rows:
+            continue
+        
+        await _upsert_rows(session, rows)
+        
+        if price_changes:
+            ids = await session.execute(
+                select(ProductModel.id, ProductModel.link).where(ProductModel.link.in_(list(price_changes)))
+            )
+            await record_price_history(session, [
+                {"product_id": row.id, **price_changes[row.link]} for row in ids.all()
+            ])
+    
+    await apply_stats_delta(session, stats_delta)
+    return changes
+
+async def mark_delisted(session: AsyncSession, category: str, seen_links: set[str],
+                        after: int = DELIST_AFTER_CRAWLS) -> ChangeSet:
+    """Учитывает полный обход категории и помечает снятыми пропавшие товары.
+
+    Вызывать только после обхода, дошедшего до конца выдачи: при обходе,
+    оборванном лимитом товаров, непросмотренные товары никуда не пропали.
+    Конец выдачи парсер видит только по таймауту скролла, а его дает и
+    медленная подгрузка, поэтому товар снимается, лишь когда его не было
+    в `after` полных обходах подряд; товар, встреченный в обходе любой
+    категории, обнуляет счетчик.
+    Строки не удаляются — на них ссылается история цен, — но из сводной
+    статистики снятые товары вычитаются.
+    """
+    changes = ChangeSet()
+    seen = list(seen_links)
+    await session.execute(
+        update(ProductModel)
+        .where(ProductModel.link.in_(seen), ProductModel.missed_crawls > 0)
+        .values(missed_crawls=0)
+    )
+    await session.execute(
+        update(ProductModel)
+        .where(
+            ProductModel.category == category,
+            ProductModel.delisted_at.is_(None),
+            ProductModel.link.not_in(seen)
+        )
+        .values(missed_crawls=func.coalesce(ProductModel.missed_crawls, 0) + 1)
+    )
+    
+    stmt = select(
+        ProductModel.id, ProductModel.name, ProductModel.link, ProductModel.price_kopecks, ProductModel.discount
+    ).where(
+        ProductModel.category == category,
+        ProductModel.delisted_at.is_(None),
+        ProductModel.missed_crawls >= after
+    )
+    missing = (await session.execute(stmt)).all()
+    if not missing:
+        return changes
+    
+    await session.execute(
+        update(ProductModel)
+        .where(ProductModel.id.in_([row.id for row in missing]))
+        .values(delisted_at=datetime.now())
+    )
+    changes.removed = [{"name": row.name, "link": row.link} for row in missing]
+    
+    stats_delta = StatsDelta()
+    for row in missing:
+        stats_delta.remove(row.discount, row.price_kopecks)
+    await apply_stats_delta(session, stats_delta)
+    return changes
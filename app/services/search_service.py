@@ -0,0 +1,111 @@
+from sqlalchemy import select, text, func, table, column
+from sqlalchemy.ext.asyncio import AsyncSession
+import re
+from app.database import engine, IS_SQLITE
+from app.models import ProductModel
+
+SEARCH_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+products_fts = table("products_fts", column("rowid"), column("name"))
+
+# Внешнее (content=) FTS5-содержимое: индекс хранит только токены названий,
+# а триггеры держат его в синхронизации с products, в том числе при
+# INSERT ... ON CONFLICT DO UPDATE из upsert_products.
+FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+]
+
+
+def build_match_query(query: str) -> str | None:
+    """Запрос пользователя -> FTS5 MATCH: все слова обязательны, каждое как префикс"""
+    tokens = SEARCH_TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def build_tsquery(query: str) -> str | None:
+    """То же для PostgreSQL to_tsquery: слова через &, каждое с :*"""
+    tokens = SEARCH_TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    return " & ".join(f"{token}:*" for token in tokens)
+
+async def ensure_search_index():
+    """Создает FTS5-индекс и триггеры; при первом создании заполняет индекс"""
+    if not IS_SQLITE:
+        return
+    async with engine.begin() as conn:
+        exists = (await conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+        )).first()
+        for statement in FTS_DDL:
+            await conn.execute(text(statement))
+        if not exists:
+            await conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            print("Создан полнотекстовый индекс товаров")
+
+async def search_products(
+    session: AsyncSession,
+    query: str,
+    min_discount: float | None = None,
+    min_price_kopecks: int | None = None,
+    max_price_kopecks: int | None = None,
+    limit: int = 20,
+    include_delisted: bool = False
+) -> list[ProductModel]:
+    """Поиск товаров по названию с ранжированием и фильтрами; снятые с продажи — только по запросу"""
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        match = build_match_query(query)
+        if not match:
+            return []
+        stmt = (
+            select(ProductModel)
+            .join(products_fts, products_fts.c.rowid == ProductModel.id)
+            .where(text("products_fts MATCH :match").bindparams(match=match))
+            .order_by(text("bm25(products_fts)"))
+        )
+    else:
+        tsquery = build_tsquery(query)
+        if not tsquery:
+            return []
+        vector = func.to_tsvector("simple", ProductModel.name)
+        ts_query = func.to_tsquery("simple", tsquery)
+        stmt = (
+            select(ProductModel)
+            .where(vector.op("@@")(ts_query))
+            .order_by(func.ts_rank(vector, ts_query).desc())
+        )
+    
+    if not include_delisted:
+        stmt = stmt.where(ProductModel.delisted_at.is_(None))
+    if min_discount is not None:
+        stmt = stmt.where(ProductModel.discount >= min_discount)
+    if min_price_kopecks is not None:
+        stmt = stmt.where(ProductModel.price_kopecks >= min_price_kopecks)
+    if max_price_kopecks is not None:
+        stmt = stmt.where(ProductModel.price_kopecks <= max_price_kopecks)
+    
+    result = await session.execute(stmt.limit(limit))
+    return result.scalars().all()
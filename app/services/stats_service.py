@@ -0,0 +1,187 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from app.database import engine
+from app.models import ProductModel, ProductStatsModel
+
+STATS_ID = 1
+
+# Столбец сводки -> подпись интервала скидки в ответе /products/stats
+DISCOUNT_BUCKETS = {
+    "discount_none": "0",
+    "discount_lt_10": "1-9",
+    "discount_10_30": "10-29",
+    "discount_30_50": "30-49",
+    "discount_50_plus": "50+",
+}
+
+
+def discount_bucket(discount: float) -> str:
+    if discount <= 0:
+        return "discount_none"
+    if discount < 10:
+        return "discount_lt_10"
+    if discount < 30:
+        return "discount_10_30"
+    if discount < 50:
+        return "discount_30_50"
+    return "discount_50_plus"
+
+
+class StatsDelta:
+    """Накопленные за одно сохранение изменения сводной статистики.
+
+    Сводка считает только товары в продаже: снятые с продажи вычитаются
+    (mark_delisted), вернувшиеся добавляются заново.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.buckets = {column: 0 for column in DISCOUNT_BUCKETS}
+        self.price_count = 0
+        self.price_sum = 0
+        self.price_min: int | None = None
+        self.price_max: int | None = None
+        self.removed_prices: list[int] = []
+        self.last_product: dict | None = None
+        self.changed = False
+
+    def add(self, discount: float, price_kopecks: int | None):
+        self.changed = True
+        self.total += 1
+        self.buckets[discount_bucket(discount)] += 1
+        if price_kopecks is not None:
+            self.price_count += 1
+            self.price_sum += price_kopecks
+            self.price_min = price_kopecks if self.price_min is None else min(self.price_min, price_kopecks)
+            self.price_max = price_kopecks if self.price_max is None else max(self.price_max, price_kopecks)
+
+    def remove(self, discount: float, price_kopecks: int | None):
+        self.changed = True
+        self.total -= 1
+        self.buckets[discount_bucket(discount)] -= 1
+        if price_kopecks is not None:
+            self.price_count -= 1
+            self.price_sum -= price_kopecks
+            self.removed_prices.append(price_kopecks)
+
+    def replace(self, old_discount: float, old_price: int | None, new_discount: float, new_price: int | None):
+        self.remove(old_discount, old_price)
+        self.add(new_discount, new_price)
+
+    @property
+    def empty(self) -> bool:
+        return not self.changed
+
+
+async def _price_bounds(session: AsyncSession) -> tuple[int | None, int | None]:
+    """Пересчет min/max цены по индексу — нужен, только если ушла крайняя цена"""
+    result = await session.execute(
+        select(func.min(ProductModel.price_kopecks), func.max(ProductModel.price_kopecks))
+        .where(ProductModel.delisted_at.is_(None))
+    )
+    return tuple(result.one())
+
+async def apply_stats_delta(session: AsyncSession, delta: StatsDelta):
+    """Применяет изменения к сводке в транзакции сохранения товаров.
+
+    Вызывается после записи товаров, поэтому в SQLite транзакция уже держит
+    блокировку на запись и сводку никто не изменит между чтением и записью.
+    """
+    if delta.empty:
+        return
+    stats = await session.get(ProductStatsModel, STATS_ID, with_for_update=True)
+    if stats is None:
+        stats = ProductStatsModel(id=STATS_ID)
+        session.add(stats)
+    
+    stats.total += delta.total
+    for column, change in delta.buckets.items():
+        setattr(stats, column, getattr(stats, column) + change)
+    stats.price_count += delta.price_count
+    stats.price_sum_kopecks += delta.price_sum
+    
+    bounds_lost = any(
+        price == stats.price_min_kopecks or price == stats.price_max_kopecks
+        for price in delta.removed_prices
+    )
+    if bounds_lost:
+        stats.price_min_kopecks, stats.price_max_kopecks = await _price_bounds(session)
+    else:
+        if delta.price_min is not None and (stats.price_min_kopecks is None or delta.price_min < stats.price_min_kopecks):
+            stats.price_min_kopecks = delta.price_min
+        if delta.price_max is not None and (stats.price_max_kopecks is None or delta.price_max > stats.price_max_kopecks):
+            stats.price_max_kopecks = delta.price_max
+    
+    if delta.last_product:
+        stats.last_update = datetime.now()
+        stats.last_product_name = delta.last_product["name"]
+        stats.last_product_price = delta.last_product["price"]
+        stats.last_product_link = delta.last_product["link"]
+    await session.flush()
+
+async def rebuild_product_stats(session: AsyncSession) -> ProductStatsModel:
+    """Строит сводку с нуля полным проходом по товарам в продаже"""
+    stats = await session.get(ProductStatsModel, STATS_ID)
+    if stats is None:
+        stats = ProductStatsModel(id=STATS_ID)
+        session.add(stats)
+    
+    delta = StatsDelta()
+    result = await session.execute(
+        select(ProductModel.price_kopecks, ProductModel.discount).where(ProductModel.delisted_at.is_(None))
+    )
+    for price_kopecks, discount in result.all():
+        delta.add(discount, price_kopecks)
+    
+    stats.total = delta.total
+    for column, count in delta.buckets.items():
+        setattr(stats, column, count)
+    stats.price_count = delta.price_count
+    stats.price_sum_kopecks = delta.price_sum
+    stats.price_min_kopecks = delta.price_min
+    stats.price_max_kopecks = delta.price_max
+    
+    last = (await session.execute(
+        select(ProductModel).order_by(ProductModel.created_at.desc()).limit(1)
+    )).scalar_one_or_none()
+    stats.last_update = last.created_at if last else None
+    stats.last_product_name = last.name if last else None
+    stats.last_product_price = last.price if last else None
+    stats.last_product_link = last.link if last else None
+    await session.flush()
+    return stats
+
+async def ensure_product_stats():
+    """Создает сводку при старте, если ее еще нет (новая или старая БД)"""
+    async with AsyncSession(engine) as session:
+        if await session.get(ProductStatsModel, STATS_ID) is None:
+            await rebuild_product_stats(session)
+            await session.commit()
+            print("Сводная статистика товаров пересчитана")
+
+def stats_to_dict(stats: ProductStatsModel | None) -> dict:
+    """Ответ /products/stats из строки сводки"""
+    if stats is None or stats.total == 0:
+        return {
+            "total": 0,
+            "last_update": None,
+            "last_product": None,
+            "discounts": {label: 0 for label in DISCOUNT_BUCKETS.values()},
+            "price": {"min_kopecks": None, "avg_kopecks": None, "max_kopecks": None}
+        }
+    return {
+        "total": stats.total,
+        "last_update": stats.last_update.isoformat() if stats.last_update else None,
+        "last_product": {
+            "name": stats.last_product_name,
+            "price": stats.last_product_price,
+            "link": stats.last_product_link
+        } if stats.last_product_link else None,
+        "discounts": {label: getattr(stats, column) for column, label in DISCOUNT_BUCKETS.items()},
+        "price": {
+            "min_kopecks": stats.price_min_kopecks,
+            "avg_kopecks": round(stats.price_sum_kopecks / stats.price_count) if stats.price_count else None,
+            "max_kopecks": stats.price_max_kopecks
+        }
+    }
@@ -9,8 +9,8 @@ from app.models import ProductModel
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.scheduler import scheduler
+from app.services.watch_service import watch_engine, KINDS
 import os
-import threading
 import httpx
 
 from dotenv import load_dotenv
@@ -34,8 +34,14 @@ async def init_telegram_bot():
     dp.message.register(start_command, Command("start"))
     dp.message.register(help_command, Command("help"))
     dp.message.register(stats_command, Command("stats"))
+    dp.message.register(watch_command, Command("watch"))
+    dp.message.register(watches_command, Command("watches"))
+    dp.message.register(unwatch_command, Command("unwatch"))
     dp.callback_query.register(handle_callback)
     
+    # Правила отслеживания: совпадения уходят сводками через этого бота
+    await watch_engine.start(send_telegram_notification)
+    
     # Запуск polling в фоне
     asyncio.create_task(dp.start_polling(bot))
     print("✅ Telegram бот инициализирован")
@@ -79,6 +85,11 @@ async def help_command(message: types.Message):
 
 /start - Главное меню
 /stats - Статистика товаров
+/watch link <ссылка> - Следить за товаром
+/watch keyword <слова> - Товары, в названии которых есть все слова
+/watch discount <N> - Товары со скидкой от N%
+/watches - Мои правила
+/unwatch <id> - Удалить правило
 /help - Эта справка
 
 *Кнопки:*
@@ -98,6 +109,50 @@ async def stats_command(message: types.Message):
     stats = await get_stats()
     await message.answer(stats)
 
+async def watch_command(message: types.Message):
+    """Обработчик команды /watch <link|keyword|discount> <значение>"""
+    if ALLOWED_USER_IDS and message.from_user.id not in ALLOWED_USER_IDS:
+        await message.answer("❌ У вас нет доступа")
+        return
+    
+    parts = (message.text or "").split(maxsplit=2)
+    if len(parts) < 3 or parts[1] not in KINDS:
+        await message.answer("Использование: /watch link <ссылка> | keyword <слова> | discount <N>")
+        return
+    try:
+        rule = await watch_engine.add_rule(message.from_user.id, parts[1], parts[2])
+    except ValueError as e:
+        await message.answer(f"❌ Правило не добавлено: {e}")
+        return
+    await message.answer(f"✅ Правило #{rule.id} добавлено: {rule.kind} {rule.value}")
+
+async def watches_command(message: types.Message):
+    """Обработчик команды /watches"""
+    if ALLOWED_USER_IDS and message.from_user.id not in ALLOWED_USER_IDS:
+        await message.answer("❌ У вас нет доступа")
+        return
+    
+    rules = await watch_engine.list_rules(message.from_user.id)
+    if not rules:
+        await message.answer("Правил пока нет. Добавьте: /watch discount 50")
+        return
+    await message.answer("👀 Ваши правила:\n\n" + "\n".join(f"#{rule.id} {rule.kind}: {rule.value}" for rule in rules))
+
+async def unwatch_command(message: types.Message):
+    """Обработчик команды /unwatch <id>"""
+    if ALLOWED_USER_IDS and message.from_user.id not in ALLOWED_USER_IDS:
+        await message.answer("❌ У вас нет доступа")
+        return
+    
+    parts = (message.text or "").split()
+    if len(parts) != 2 or not parts[1].lstrip("#").isdigit():
+        await message.answer("Использование: /unwatch <id>")
+        return
+    if await watch_engine.remove_rule(message.from_user.id, int(parts[1].lstrip("#"))):
+        await message.answer("🗑 Правило удалено")
+    else:
+        await message.answer("❌ Правило не найдено")
+
 # Клавиатуры
 def get_main_keyboard():
     """Главная клавиатура"""
@@ -117,6 +172,15 @@ def get_main_keyboard():
     return keyboard
 
 
+async def notify_parser_event(event: dict):
+    """Приемник шины событий: ошибки парсера уходят разрешенным пользователям"""
+    if event.get("type") != "parser_status" or event.get("status") != "error":
+        return
+    for chat_id in ALLOWED_USER_IDS:
+        await send_telegram_notification(
+            chat_id, f"⚠️ *Парсинг завершен*\n\n{event.get('message')}", parse_mode="Markdown"
+        )
+
 # Обработчик callback кнопок
 async def handle_callback(callback: CallbackQuery):
     """Обработчик нажатий на кнопки"""
@@ -142,12 +206,16 @@ async def handle_callback(callback: CallbackQuery):
         await callback.answer("🚀 Запускаю парсер...")
         await send_telegram_notification(chat_id, "🚀 Парсер запущен вручную!")
         
-        from app.services.parser_service import OzonParser
+        from app.services.parser_service import get_category_urls
+        from app.services.job_service import job_registry
+        from app.scheduler import enqueue_categories, PARSER_USE_WORKERS
         
-        ozon_parser = OzonParser()
-        category_url = "https://www.ozon.ru/category/nastolnye-igry-13507/"
-        thread = threading.Thread(target=ozon_parser.start, args=(category_url,))
-        thread.start()
+        if PARSER_USE_WORKERS:
+            # Парсят воркеры: категории уходят в их очередь
+            await enqueue_categories(get_category_urls(), manual=True)
+        else:
+            # Повторные нажатия присоединяются к уже идущим заданиям
+            job_registry.submit_many(get_category_urls(), source="telegram")
     
     elif data == "parser_status":
         status = await get_parser_status()
@@ -218,29 +286,48 @@ async def get_stats():
             else:
                 last_date = "Нет данных"
             
-            return (
+            text = (
                 f"📊 *Статистика:*\n\n"
                 f"📦 Всего товаров: *{total}*\n"
                 f"🕐 Последнее обновление: {last_date}\n"
                 f"🔗 Последний товар: {last_product['name'][:50] if last_product and last_product.get('name') else 'Нет'}"
             )
+            
+            price = data.get("price") or {}
+            if price.get("min_kopecks") is not None:
+                text += (
+                    f"\n💰 Цены: от {price['min_kopecks'] / 100:.0f} до {price['max_kopecks'] / 100:.0f} ₽, "
+                    f"в среднем {price['avg_kopecks'] / 100:.0f} ₽"
+                )
+            return text
     except Exception as e:
         print(f"Ошибка при получении статистики: {e}")
         return "❌ Ошибка при получении статистики"
 
 async def get_parser_status():
     """Получить статус парсера"""
+    from app.services.job_service import job_registry
+    
+    running = [job for job in job_registry.list() if job.active]
+    text = ""
+    if running:
+        text = "🔄 *Идет парсинг:*\n"
+        for job in running:
+            progress = job.to_dict()["progress"]
+            text += f"• {job.category[:50]} — товаров: {progress['products_found']}, скроллов: {progress['scrolls']}\n"
+        text += "\n"
+    
     jobs = scheduler.get_jobs()
     if jobs:
         next_run = jobs[0].next_run_time
         next_run_str = next_run.strftime("%d.%m.%Y %H:%M") if next_run else "Не запланировано"
         return (
-            f"📊 *Статус парсера:*\n\n"
+            f"📊 *Статус парсера:*\n\n{text}"
             f"✅ Планировщик активен\n"
             f"⏰ Следующий запуск: {next_run_str}\n"
             f"🔄 Интервал: каждый час"
         )
-    return "❌ Планировщик не активен"
+    return text + "❌ Планировщик не активен"
 
 async def get_last_products(limit: int = 5):
     """Получить последние товары через API"""
@@ -291,29 +378,3 @@ async def get_top_games_with_discount(limit: int = 10):
     except Exception as e:
         print(f"Ошибка при получении топ игр: {e}")
         return "❌ Ошибка при получении топ игр"
-
-# Функция для отправки уведомлений из парсера
-def send_parser_notification(chat_ids: list[int], message: str):
-    """Отправляет уведомление о парсере через Telegram HTTP API (синхронно)"""
-    if not TELEGRAM_BOT_TOKEN or TELEGRAM_BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-        print("⚠️ Telegram бот не настроен")
-        return
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    
-    for chat_id in chat_ids:
-        try:
-            # Используем синхронный HTTP запрос
-            with httpx.Client(timeout=10.0) as client:
-                response = client.post(
-                    url,
-                    json={
-                        "chat_id": chat_id,
-                        "text": message,
-                        "parse_mode": "Markdown"
-                    }
-                )
-                response.raise_for_status()
-                print(f"✅ Уведомление отправлено в Telegram (chat_id: {chat_id})")
-        except Exception as e:
-            print(f"❌ Ошибка отправки в Telegram: {e}")
\ No newline at end of file
@@ -0,0 +1,305 @@
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Awaitable, Callable
+from urllib.parse import urlparse
+import asyncio
+import bisect
+import re
+import os
+from app.database import engine
+from app.models import WatchRuleModel
+from app.services.nats_service import nats_service
+from dotenv import load_dotenv
+load_dotenv()
+
+WATCH_FLUSH_INTERVAL = float(os.getenv("WATCH_FLUSH_INTERVAL", "60"))  # сек между сводками пользователю
+WATCH_MESSAGE_ITEMS = 10  # товаров в одной сводке, остальные — числом
+WATCH_MAX_RULES = int(os.getenv("WATCH_MAX_RULES", "100"))  # правил на пользователя
+WATCH_RELOAD_INTERVAL = float(os.getenv("WATCH_RELOAD_INTERVAL", "300"))  # сек между перечитываниями правил из БД
+
+# Группа NATS, в которой события товаров сопоставляет один процесс из всех
+# реплик, и тема, по которой реплики узнают о добавленных и удаленных правилах
+WATCH_QUEUE = "watch-engine"
+WATCH_RULES_SUBJECT = "watch.rules"
+
+KIND_LINK = "link"
+KIND_KEYWORD = "keyword"
+KIND_DISCOUNT = "discount"
+KINDS = (KIND_LINK, KIND_KEYWORD, KIND_DISCOUNT)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+Notifier = Callable[[int, str], Awaitable[None]]
+
+
+def tokenize(text: str) -> set[str]:
+    return set(WORD_RE.findall(text.lower().replace("ё", "е")))
+
+def link_key(link: str) -> str:
+    """Ключ ссылки без схемы, домена, параметров и завершающего слэша"""
+    return urlparse(link.strip()).path.rstrip("/")
+
+def normalize_rule(kind: str, value: str) -> str:
+    """Значение правила в каноническом виде; ValueError, если оно некорректно"""
+    if kind == KIND_LINK:
+        key = link_key(value)
+        if "/product/" not in key:
+            raise ValueError("нужна ссылка на товар Ozon")
+        return key
+    if kind == KIND_KEYWORD:
+        words = sorted(tokenize(value))
+        if not words:
+            raise ValueError("нужно хотя бы одно слово")
+        return " ".join(words)
+    if kind == KIND_DISCOUNT:
+        threshold = float(value.strip().rstrip("%").replace(",", "."))
+        if not 0 < threshold <= 100:
+            raise ValueError("порог скидки должен быть от 1 до 100")
+        return f"{threshold:g}"
+    raise ValueError(f"неизвестный тип правила: {kind}")
+
+
+class RuleIndex:
+    """Индекс правил для сопоставления без перебора всех правил.
+
+    Ссылки — словарь ключ ссылки -> пользователи; ключевые слова — обратный
+    индекс по самому длинному слову правила (остальные слова проверяются
+    только у кандидатов); пороги скидки — отсортированный список, нужные
+    правила находятся bisect'ом. Стоимость сопоставления товара зависит от
+    числа слов в его названии и числа сработавших правил, а не от общего
+    числа правил.
+    """
+
+    def __init__(self):
+        self.links: dict[str, set[int]] = {}
+        self.keywords: dict[str, list[tuple[int, int, frozenset[str]]]] = {}
+        self.discounts: list[tuple[float, int, int]] = []  # (порог, user_id, rule_id)
+
+    def add(self, rule: WatchRuleModel):
+        if rule.kind == KIND_LINK:
+            self.links.setdefault(rule.value, set()).add(rule.user_id)
+        elif rule.kind == KIND_KEYWORD:
+            words = frozenset(rule.value.split())
+            anchor = max(words, key=len)
+            self.keywords.setdefault(anchor, []).append((rule.id, rule.user_id, words))
+        elif rule.kind == KIND_DISCOUNT:
+            bisect.insort(self.discounts, (float(rule.value), rule.user_id, rule.id))
+
+    def remove(self, rule: WatchRuleModel):
+        if rule.kind == KIND_LINK:
+            users = self.links.get(rule.value)
+            if users is not None:
+                users.discard(rule.user_id)
+                if not users:
+                    del self.links[rule.value]
+        elif rule.kind == KIND_KEYWORD:
+            words = frozenset(rule.value.split())
+            anchor = max(words, key=len)
+            bucket = [entry for entry in self.keywords.get(anchor, []) if entry[0] != rule.id]
+            if bucket:
+                self.keywords[anchor] = bucket
+            else:
+                self.keywords.pop(anchor, None)
+        elif rule.kind == KIND_DISCOUNT:
+            entry = (float(rule.value), rule.user_id, rule.id)
+            i = bisect.bisect_left(self.discounts, entry)
+            if i < len(self.discounts) and self.discounts[i] == entry:
+                del self.discounts[i]
+
+    def match(self, product: dict) -> dict[int, list[str]]:
+        """Пользователи, чьи правила сработали на товар, и причины срабатывания.
+
+        Товар без previous_price_kopecks/previous_discount считается новым.
+        Ссылки и ключевые слова срабатывают на новый товар и на падение цены
+        (рост цены и правки названия не оповещают); пороги скидки — на новый
+        товар и когда скидка впервые достигла порога, а не на каждое
+        обновление товара, который порог уже проходил.
+        """
+        matches: dict[int, list[str]] = {}
+        is_new = "previous_price_kopecks" not in product and "previous_discount" not in product
+        price, previous_price = product.get("price_kopecks"), product.get("previous_price_kopecks")
+        price_dropped = price is not None and previous_price is not None and price < previous_price
+
+        if is_new or price_dropped:
+            for user_id in self.links.get(link_key(product.get("link") or ""), ()):
+                matches.setdefault(user_id, []).append("отслеживаемый товар")
+
+            words = tokenize(product.get("name") or "")
+            for word in words:
+                for _, user_id, rule_words in self.keywords.get(word, ()):
+                    if rule_words <= words:
+                        matches.setdefault(user_id, []).append(f"«{' '.join(sorted(rule_words))}»")
+
+        discount = product.get("discount") or 0
+        previous_discount = 0 if is_new else product.get("previous_discount") or 0
+        # Пороги выше прежней скидки и не выше новой — отрезок отсортированного списка
+        start = bisect.bisect_right(self.discounts, (previous_discount, float("inf")))
+        end = bisect.bisect_right(self.discounts, (discount, float("inf")))
+        for threshold, user_id, _ in self.discounts[start:end]:
+            matches.setdefault(user_id, []).append(f"скидка ≥ {threshold:g}%")
+        return matches
+
+
+class WatchEngine:
+    """Правила отслеживания пользователей и сводки совпадений в Telegram.
+
+    События products_saved (новые и обновленные товары с прежними ценой и
+    скидкой) сопоставляются с индексом правил сразу, а совпадения копятся по пользователям и уходят одним сообщением раз в
+    WATCH_FLUSH_INTERVAL секунд.
+
+    При нескольких репликах API событие из NATS получает только одна из них
+    (группа WATCH_QUEUE), поэтому сводка не дублируется. Индекс правил есть
+    в каждой реплике: изменения правил рассылаются по WATCH_RULES_SUBJECT, а
+    раз в WATCH_RELOAD_INTERVAL секунд индекс перечитывается из БД на случай
+    пропущенных сообщений.
+    """
+
+    def __init__(self):
+        self.index = RuleIndex()
+        self._rules: dict[int, WatchRuleModel] = {}  # правила в индексе по id
+        self._pending: dict[int, dict[str, dict]] = {}  # user_id -> ссылка -> совпадение
+        self._notifier: Notifier | None = None
+        self._flusher: asyncio.Task | None = None
+
+    async def start(self, notifier: Notifier):
+        """Загружает правила в индекс и запускает отправку сводок"""
+        self._notifier = notifier
+        await self.reload()
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+        print(f"Загружено правил отслеживания: {len(self._rules)}")
+
+    async def listen(self):
+        """Подписывается на события товаров (в группе реплик) и на изменения правил"""
+        async def on_event(event: dict, seq: int | None):
+            await self.handle_event(event)
+
+        await nats_service.subscribe_updates(on_event, queue=WATCH_QUEUE)
+        await nats_service.subscribe_control(WATCH_RULES_SUBJECT, self._on_rule_change)
+
+    async def reload(self):
+        """Строит индекс заново по правилам из БД"""
+        async with AsyncSession(engine) as session:
+            rules = (await session.execute(select(WatchRuleModel))).scalars().all()
+        index = RuleIndex()
+        for rule in rules:
+            index.add(rule)
+        self.index, self._rules = index, {rule.id: rule for rule in rules}
+
+    def _apply(self, action: str, rule: WatchRuleModel):
+        """Добавляет или убирает правило из индекса; повтор ничего не меняет"""
+        if action == "add" and rule.id not in self._rules:
+            self._rules[rule.id] = rule
+            self.index.add(rule)
+        elif action == "remove":
+            known = self._rules.pop(rule.id, None)
+            if known is not None:
+                self.index.remove(known)
+
+    async def _publish_rule_change(self, action: str, rule: WatchRuleModel):
+        await nats_service.publish_control(WATCH_RULES_SUBJECT, {
+            "action": action,
+            "rule": {"id": rule.id, "user_id": rule.user_id, "kind": rule.kind, "value": rule.value}
+        })
+
+    async def _on_rule_change(self, data: dict):
+        try:
+            self._apply(data["action"], WatchRuleModel(**data["rule"]))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Некорректное изменение правила отслеживания: {e}")
+
+    async def add_rule(self, user_id: int, kind: str, value: str) -> WatchRuleModel:
+        """Сохраняет правило; ValueError, если оно некорректно, повторяется или правил слишком много"""
+        value = normalize_rule(kind, value)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            rules = await self.list_rules(user_id, session)
+            if len(rules) >= WATCH_MAX_RULES:
+                raise ValueError(f"не больше {WATCH_MAX_RULES} правил")
+            rule = WatchRuleModel(user_id=user_id, kind=kind, value=value)
+            session.add(rule)
+            try:
+                await session.commit()
+            except IntegrityError:
+                raise ValueError("такое правило уже есть")
+        self._apply("add", rule)
+        await self._publish_rule_change("add", rule)
+        return rule
+
+    async def remove_rule(self, user_id: int, rule_id: int) -> bool:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            rule = await session.get(WatchRuleModel, rule_id)
+            if rule is None or rule.user_id != user_id:
+                return False
+            await session.execute(delete(WatchRuleModel).where(WatchRuleModel.id == rule_id))
+            await session.commit()
+        self._apply("remove", rule)
+        await self._publish_rule_change("remove", rule)
+        return True
+
+    async def list_rules(self, user_id: int, session: AsyncSession | None = None) -> list[WatchRuleModel]:
+        stmt = select(WatchRuleModel).where(WatchRuleModel.user_id == user_id).order_by(WatchRuleModel.id)
+        if session is not None:
+            return (await session.execute(stmt)).scalars().all()
+        async with AsyncSession(engine) as session:
+            return (await session.execute(stmt)).scalars().all()
+
+    async def handle_event(self, event: dict):
+        """Сопоставляет товары события products_saved с правилами.
+
+        price_drop не нужен: те же товары приходят в products_saved с
+        прежней ценой, и RuleIndex.match сам решает, о чем оповещать.
+        """
+        if event.get("type") != "products_saved":
+            return
+        for product in event.get("products") or []:
+            for user_id, reasons in self.index.match(product).items():
+                pending = self._pending.setdefault(user_id, {})
+                entry = pending.setdefault(product["link"], {"reasons": set()})
+                entry.update(product)
+                entry["reasons"].update(reasons)
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        for user_id, products in pending.items():
+            try:
+                await self._notifier(user_id, format_alert(list(products.values())))
+            except Exception as e:
+                print(f"Ошибка отправки сводки пользователю {user_id}: {e}")
+
+    async def _flush_periodically(self):
+        loop = asyncio.get_running_loop()
+        next_reload = loop.time() + WATCH_RELOAD_INTERVAL
+        while True:
+            await asyncio.sleep(WATCH_FLUSH_INTERVAL)
+            if self._pending and self._notifier:
+                await self.flush()
+            if loop.time() >= next_reload:
+                next_reload = loop.time() + WATCH_RELOAD_INTERVAL
+                try:
+                    await self.reload()
+                except Exception as e:
+                    print(f"Ошибка при перечитывании правил отслеживания: {e}")
+
+
+def format_alert(products: list[dict]) -> str:
+    """Одна сводка по всем совпадениям пользователя"""
+    products.sort(key=lambda product: product.get("discount") or 0, reverse=True)
+    text = f"🔔 Совпадения по вашим правилам: {len(products)}\n\n"
+    for i, product in enumerate(products[:WATCH_MESSAGE_ITEMS], 1):
+        text += f"{i}. {(product.get('name') or '')[:60]}\n"
+        price = f"   💰 {product.get('price')}"
+        previous = product.get("previous_price_kopecks")
+        if previous and product.get("price_kopecks") is not None and product["price_kopecks"] < previous:
+            price += f" (было {previous / 100:.0f} ₽)"
+        text += price + "\n"
+        if product.get("discount"):
+            text += f"   🔥 Скидка: -{product['discount']:.0f}%\n"
+        text += f"   📌 {', '.join(sorted(product['reasons']))}\n"
+        text += f"   🔗 {product.get('link')}\n\n"
+    if len(products) > WATCH_MESSAGE_ITEMS:
+        text += f"…и еще {len(products) - WATCH_MESSAGE_ITEMS}"
+    return text
+
+
+watch_engine = WatchEngine()
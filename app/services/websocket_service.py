@@ -1,40 +1,283 @@
 from fastapi import WebSocket
 import asyncio
-import threading
+import json
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))  # сообщений в очереди одного клиента
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # сек на одну отправку
+WS_MAX_DROPPED = int(os.getenv("WS_MAX_DROPPED", "500"))  # потерь подряд, после которых клиент отключается
+
+# Типы событий, на которые можно подписаться через /ws
+TOPICS = ("parser_status", "products_saved", "price_drop", "new_product", "removed", "system", "error")
+
+
+class Subscription:
+    """Фильтр событий клиента: темы, категории и порог скидки.
+
+    Пустой фильтр (None) пропускает все. Событие без поля category или без
+    скидки проходит соответствующий фильтр — отсеиваются только события,
+    которые явно ему не соответствуют. Порог скидки применяется к каждому
+    товару события: клиент получает копию только с подходящими товарами.
+    """
+
+    def __init__(self):
+        self.topics: set[str] = set()
+        self.categories: set[str] | None = None
+        self.min_discount: float | None = None
+
+    def update(self, request: dict):
+        """Применяет subscribe/unsubscribe; ValueError, если поля не того типа.
+
+        Первый subscribe без topics (только категории или порог скидки)
+        подписывает на все темы, а не оставляет клиента без событий.
+        """
+        topics = request.get("topics") or []
+        categories = request.get("categories")
+        if not isinstance(topics, list):
+            raise ValueError("topics must be a list")
+        if categories is not None and not isinstance(categories, list):
+            raise ValueError("categories must be a list")
+        min_discount = request.get("min_discount")
+        min_discount = float(min_discount) if min_discount is not None else None
+        if request.get("action") == "unsubscribe":
+            self.topics.difference_update(topics)
+            return
+        self.topics.update(topic for topic in topics if topic in TOPICS)
+        if not self.topics:
+            self.topics.update(TOPICS)
+        if "categories" in request:
+            self.categories = set(categories) if categories else None
+        if "min_discount" in request:
+            self.min_discount = min_discount
+
+    def matches(self, event: dict) -> bool:
+        if event.get("type") not in self.topics:
+            return False
+        category = event.get("category")
+        if self.categories is not None and category and category not in self.categories:
+            return False
+        if self.min_discount is not None and "discount" in event and (event["discount"] or 0) < self.min_discount:
+            return False
+        return True
+
+    def trims(self, event: dict) -> bool:
+        """Нужно ли вырезать из события товары ниже порога скидки"""
+        return self.min_discount is not None and bool(event.get("products"))
+
+    def to_dict(self) -> dict:
+        return {
+            "topics": sorted(self.topics),
+            "categories": sorted(self.categories) if self.categories is not None else None,
+            "min_discount": self.min_discount
+        }
+
+
+def render_event(event: dict, threshold: float | None) -> str | None:
+    """JSON события, из которого убраны товары со скидкой ниже `threshold`.
+
+    None — в событии не осталось товаров, отправлять нечего.
+    """
+    if threshold is None:
+        return json.dumps(event, ensure_ascii=False)
+    products = [product for product in event["products"] if (product.get("discount") or 0) >= threshold]
+    if not products:
+        return None
+    if len(products) < len(event["products"]):
+        event = {**event, "products": products}
+    return json.dumps(event, ensure_ascii=False)
+
+
+class Client:
+    """WebSocket клиент со своей очередью отправки и задачей-писателем"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self.writer: asyncio.Task | None = None
+        self.subscription: Subscription | None = None  # None — все события
+
+    def wants(self, event: dict | None) -> bool:
+        if self.subscription is None:
+            return True
+        return event is not None and self.subscription.matches(event)
+
+    def threshold(self, event: dict | None) -> float | None:
+        """Порог скидки, по которому клиенту режутся товары события (None — событие целиком)"""
+        if self.subscription is None or event is None or not self.subscription.trims(event):
+            return None
+        return self.subscription.min_discount
+
+    def offer(self, data: str) -> bool:
+        """Кладет сообщение в очередь, не ожидая клиента.
+
+        Если очередь полна, выбрасывается самое старое сообщение — медленный
+        клиент получает только свежие. Возвращает False, когда клиент теряет
+        сообщения слишком долго и его пора отключить.
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+        return self.dropped < WS_MAX_DROPPED
+
+    async def put(self, data: str) -> bool:
+        """Кладет сообщение в очередь, дожидаясь места, — без потерь (для replay).
+
+        Возвращает False, если писатель не освободил место за WS_SEND_TIMEOUT.
+        """
+        try:
+            await asyncio.wait_for(self.queue.put(data), WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
 
 class ConnectionManager:
+    """Рассылка по WebSocket: broadcast только раскладывает сообщение по
+    очередям клиентов, а отправляют их писатели клиентов параллельно, так что
+    медленный или мертвый сокет не задерживает остальных.
+    """
+
     def __init__(self):
-        self.active_connection: list[WebSocket] = []
+        self.clients: dict[WebSocket, Client] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connection.append(websocket)
+        client = Client(websocket)
+        client.writer = asyncio.create_task(self._write(client))
+        self.clients[websocket] = client
 
     async def handle(self, data, websocket):
-        if data == "spec":   
-            await websocket.send_text("Spec ok!")
+        if data == "spec":
+            await self.send(websocket, "Spec ok!")
         elif data == "close":
             await self.disconnect(websocket)
+        elif data.startswith("{"):
+            await self._handle_subscription(data, websocket)
 
-    async def disconnect(self, websocket: WebSocket):
-        await websocket.close()
-        self.active_connection.remove(websocket)
+    async def _replay(self, client: Client, from_seq: int):
+        """Досылает клиенту события из JetStream начиная с номера from_seq.
 
-    async def broadcast(self, data: str):
-        for ws in self.active_connection:
-            await ws.send_text(data)
+        В отличие от broadcast, события не выбрасываются при полной очереди:
+        replay ждет, пока писатель клиента освободит место, и отключает
+        клиента, только если тот перестал принимать сообщения.
+        """
+        from app.services.nats_service import nats_service
+        
+        events = await nats_service.replay(from_seq)
+        sent = 0
+        for seq, event in events:
+            event["seq"] = seq
+            if not client.wants(event):
+                continue
+            data = render_event(event, client.threshold(event))
+            if data is None:
+                continue
+            if self.clients.get(client.websocket) is not client:
+                return  # клиент отключился во время replay
+            if not await client.put(data):
+                print("WebSocket клиент не принимает replay, отключаем")
+                await self.disconnect(client.websocket)
+                return
+            sent += 1
+        await client.put(json.dumps({"type": "replayed", "count": sent}))
 
+    async def _handle_subscription(self, data: str, websocket: WebSocket):
+        """{"action": "subscribe" | "unsubscribe", "topics": [...], "categories": [...], "min_discount": 30}
 
-manager_ws = ConnectionManager()
+        unsubscribe без тем снимает фильтр, и клиент снова получает все события.
+        {"action": "replay", "from_seq": N} досылает пропущенные события из
+        JetStream (номер последнего полученного события — в поле seq).
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        try:
+            request = json.loads(data)
+            action = request.get("action")
+            if action not in ("subscribe", "unsubscribe", "replay"):
+                raise ValueError(f"unknown action {action!r}")
+            if action == "replay":
+                await self._replay(client, int(request["from_seq"]))
+                return
+            if action == "unsubscribe" and not request.get("topics"):
+                client.subscription = None
+            else:
+                # Новый фильтр назначается только после успешной проверки запроса
+                subscription = client.subscription or Subscription()
+                subscription.update(request)
+                client.subscription = subscription
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            await self.send(websocket, json.dumps({"type": "error", "message": f"Неверная подписка: {e}"}, ensure_ascii=False))
+            return
+        await self.send(websocket, json.dumps({
+            "type": "subscription",
+            **(client.subscription.to_dict() if client.subscription else {"topics": list(TOPICS)})
+        }, ensure_ascii=False))
+
+    async def send(self, websocket: WebSocket, data: str):
+        """Сообщение одному клиенту через его очередь"""
+        client = self.clients.get(websocket)
+        if client and not client.offer(data):
+            await self.disconnect(websocket)
+
+    async def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        try:
+            await websocket.close()
+        except Exception:
+            pass  # сокет уже закрыт клиентом
+
+    async def broadcast(self, data: str | dict):
+        """Рассылает событие подписанным клиентам.
 
-def send_ws_notification(message: str):
-    def run_async():
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
+        Событие сериализуется один раз на каждый встретившийся порог скидки:
+        клиенты без порога получают его целиком, с порогом — копию только с
+        подходящими товарами (или ничего, если таких нет).
+        """
+        if isinstance(data, str):
+            try:
+                event = json.loads(data)
+            except ValueError:
+                event = None
+        else:
+            event, data = data, json.dumps(data, ensure_ascii=False)
+        if not isinstance(event, dict):
+            event = None
+        
+        payloads: dict[float | None, str | None] = {None: data}
+        slow = []
+        for websocket, client in self.clients.items():
+            if not client.wants(event):
+                continue
+            threshold = client.threshold(event)
+            if threshold not in payloads:
+                payloads[threshold] = render_event(event, threshold)
+            payload = payloads[threshold]
+            if payload is not None and not client.offer(payload):
+                slow.append(websocket)
+        for websocket in slow:
+            print("WebSocket клиент не успевает получать сообщения, отключаем")
+            await self.disconnect(websocket)
+
+    async def _write(self, client: Client):
         try:
-            new_loop.run_until_complete(manager_ws.broadcast(message))
-        finally:
-            new_loop.close()
-    thread = threading.Thread(target=run_async)
-    thread.start()
\ No newline at end of file
+            while True:
+                data = await client.queue.get()
+                await asyncio.wait_for(client.websocket.send_text(data), WS_SEND_TIMEOUT)
+                client.dropped = 0
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Ошибка отправки WebSocket, клиент отключен: {e}")
+            await self.disconnect(client.websocket)
+
+
+manager_ws = ConnectionManager()
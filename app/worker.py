@@ -0,0 +1,87 @@
+import asyncio
+import json
+import signal
+from nats.errors import TimeoutError as NatsTimeoutError
+from app.database import init_db
+from app.services.stats_service import ensure_product_stats
+from app.services.search_service import ensure_search_index
+from app.services.browser_service import browser_pool
+from app.services.event_service import event_bus
+from app.services.nats_service import nats_service, PARSER_JOB_ACK_WAIT
+from app.services.parser_service import OzonParser, PARSER_CONCURRENCY
+
+JOB_RETRY_DELAY = 30  # сек до повторной выдачи задания после ошибки
+
+
+async def _keep_lease(msg):
+    """Продлевает аренду задания, пока парсер работает"""
+    while True:
+        await asyncio.sleep(PARSER_JOB_ACK_WAIT / 3)
+        await msg.in_progress()
+
+async def _run_job(msg):
+    try:
+        category_url = json.loads(msg.data.decode())["category"]
+    except (ValueError, KeyError, TypeError):
+        print(f"Некорректное задание отброшено: {msg.data[:100]!r}")
+        await msg.term()
+        return
+    attempt = msg.metadata.num_delivered
+    print(f"Воркер взял задание: {category_url} (попытка {attempt})")
+
+    lease = asyncio.create_task(_keep_lease(msg))
+    try:
+        await OzonParser().start(category_url)
+    except Exception as e:
+        print(f"Ошибка задания {category_url}: {e}")
+        await msg.nak(delay=JOB_RETRY_DELAY)
+        return
+    finally:
+        lease.cancel()
+    await msg.ack()
+
+async def _consume(subscription, stopping: asyncio.Event):
+    while not stopping.is_set():
+        try:
+            messages = await subscription.fetch(1, timeout=5)
+        except NatsTimeoutError:
+            continue
+        for msg in messages:
+            await _run_job(msg)
+
+async def run_worker():
+    """Воркер парсера: берет задания категорий из очереди NATS и парсит их.
+
+    Каждое задание арендуется на PARSER_JOB_ACK_WAIT секунд и продлевается,
+    пока идет парсинг; после успешного сохранения подтверждается. Если ни
+    одна пачка не сохранилась (OzonParser.start бросает исключение), задание
+    возвращается в очередь с задержкой. Если воркер упал, аренда истекает и
+    задание получает другой воркер.
+    """
+    await init_db()
+    await ensure_product_stats()
+    await ensure_search_index()
+    await browser_pool.start()
+    await nats_service.connect()
+
+    # У воркера нет WebSocket клиентов: все события уходят в NATS, а API
+    # рассылает их своим клиентам из подписки на products.updates
+    event_bus.subscribe(nats_service.sink)
+    event_bus.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            pass  # Windows
+
+    subscription = await nats_service.jobs_subscription()
+    print(f"✅ Воркер парсера запущен, параллельных заданий: {PARSER_CONCURRENCY}")
+    try:
+        await asyncio.gather(*(_consume(subscription, stopping) for _ in range(PARSER_CONCURRENCY)))
+    finally:
+        await browser_pool.stop()
+        await event_bus.stop()
+        await nats_service.close()